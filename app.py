@@ -1,13 +1,14 @@
 import keras
 import taskrecon_converter as cvt
 import taskrecon_guesser as gue
+import taskrecon_feed as feed
+import taskrecon_fold as fold
 import os
 import plotter
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import glob
-import math
 from pathlib2 import Path
 import numpy as np
 import json
@@ -29,26 +30,9 @@ def save_result(fileName, data_dict):
     return
 
 
-def generate_single_fold(fold_count, data_pair, batch_size=1):
-    example_list = data_pair[0]
-    label_list = data_pair[1]
-    partition = fold_count + 1
-    if len(example_list) != len(label_list):
-        raise ValueError("expected example and label to have same number of samples")
-
-    partition_size = math.floor(len(example_list) / partition)
-    partition_size -= partition_size % batch_size
-
-    ''' list of lists. each element of result is a list of partition where the last parition is the testing set'''
-    result = []
-
-    fold = []
-    fold.append(cvt.chunk_examples(example_list, label_list, 0, (fold_count) * partition_size))
-    fold.append(
-        cvt.chunk_examples(example_list, label_list, (fold_count) * partition_size, (fold_count + 1) * partition_size))
-    result.append(fold)
-
-    return result
+# list holding one taskrecon_fold.Fold of index ranges, the train and test sets are materialized when used
+def generate_single_fold(fold_count, data_pair, batch_size=1, dtype=np.float32):
+    return [fold.single_fold(fold_count, data_pair, batch_size, dtype)]
 
 
 if __name__ == "__main__":
@@ -69,6 +53,7 @@ if __name__ == "__main__":
     result_list = []
 
     fileNames = glob.glob('./data/*.data')
+    # "sparse_categorical_crossentropy" trains on integer labels instead of one-hot ones
     loss = ["categorical_crossentropy"]
     node_size = [100]
     batch_size = [1000]
@@ -77,11 +62,22 @@ if __name__ == "__main__":
     gap = [False]
     drop_out = [True]
     fold_count = 4
+    # None trains on the whole trace, the feed only one-hot encodes one batch at a time
+    trace_stop = 200000
+    # None feeds one-hot inputs. a size feeds int task ids through an Embedding of that size (label_card times less input)
+    embedding_dim = None
+    # True trains the stateful model on stream_batch_size contiguous streams of non-overlapping windows (every tick
+    # once per epoch) instead of the overlapped windows. every one of the fold_count + 1 partitions of the trace needs
+    # stream_batch_size * time_steps ticks: 20 streams of 100 steps fit the 40000 tick partitions of trace_stop=200000
+    stream_layout = False
+    stream_batch_size = 20
 
     iteration = 0
 
     for name in fileNames:
-        data_list = cvt.newText_to_list(name)[0:200000]
+        data_list = cvt.newText_to_list(name, 0, trace_stop)
+        # one-hot width, task ids that never run in this trace keep their column
+        label_card = cvt.trace_manifest(name)["label_range"]
         for t in time_steps:
             for l in loss:
                 for d in drop_out:
@@ -94,16 +90,25 @@ if __name__ == "__main__":
                                 for n in node_size:
                                     n_size = n
                                     b_size = b
+                                    if stream_layout:
+                                        b_size = stream_batch_size
                                     time = t
                                     ep = e
                                     out = d
+                                    sparse = l == "sparse_categorical_crossentropy"
                                     if l == "poisson":
                                         lo = "poi"
+                                    elif sparse:
+                                        lo = "sca"
                                     else:
                                         lo = "ca"
                                     id = name.split("/")[-1].split(".")[0] + ".result"
                                     directory = "./result/" + id
                                     fileName = lo + "_lstm_lstm_fold_n" + str(n_size) + "_e" + str(ep) + "_g" + str(g)
+                                    if embedding_dim is not None:
+                                        fileName += "_emb" + str(embedding_dim)
+                                    if stream_layout:
+                                        fileName += "_stream"
                                     modelName = directory + "/" + fileName + ".model"
                                     statName = directory + "/stat.json"
 
@@ -116,28 +121,38 @@ if __name__ == "__main__":
                                         exit()
 
                                     print("Going to GENERATE")
-                                    folds = generate_single_fold(fold_count,
-                                                                 cvt.list_to_example_overlap(data_list, time_steps=time,
-                                                                                             overlap_gap=g),
-                                                                 batch_size=b_size)
+                                    if stream_layout:
+                                        train_feed, test_feed = feed.stream_fold_feeds(fold_count, data_list, b_size,
+                                                                                       time_steps=time,
+                                                                                       index_inputs=embedding_dim is not None,
+                                                                                       sparse_labels=sparse,
+                                                                                       label_card=label_card)
+                                    else:
+                                        train_feed, test_feed = feed.single_fold_feeds(fold_count,
+                                                                     cvt.list_to_example_overlap(data_list, time_steps=time,
+                                                                                                 overlap_gap=g,
+                                                                                                 label_card=label_card,
+                                                                                                 one_hot=embedding_dim is None,
+                                                                                                 sparse_labels=sparse),
+                                                                     batch_size=b_size,
+                                                                     index_inputs=embedding_dim is not None,
+                                                                     sparse_labels=sparse,
+                                                                     label_card=label_card)
 
                                     i = 1
                                     iteration += 1
 
-                                    fold = folds[0]
-                                    x_train = fold[0][0]
-                                    y_train = fold[0][1]
-                                    x_test = fold[1][0]
-                                    y_test = fold[1][1]
-
-                                    class_card = len(x_train[0][0])
+                                    class_card = train_feed.label_card
 
                                     if not file_exists(modelName):
                                         print("Going to CREATE MODEL")
                                         model = gue.create_model(n_size, (time, class_card), stateful=True,
                                                                  batch=b_size,
-                                                                 output_dim=class_card, loss=l, drop_out=out)
-                                        model.fit(x_train, y_train, epochs=ep, batch_size=b_size, verbose=1)
+                                                                 output_dim=class_card, loss=l, drop_out=out,
+                                                                 embedding_dim=embedding_dim)
+                                        callbacks = [feed.ResetStates()] if stream_layout else None
+                                        model.fit_generator(train_feed, epochs=ep, verbose=1, shuffle=False,
+                                                            callbacks=callbacks)
                                         if not os.path.exists(directory):
                                             os.makedirs(directory)
                                         model.save(modelName)
@@ -146,12 +161,12 @@ if __name__ == "__main__":
 
                                     i += 1
 
-                                    if g > 1:
-                                        (cnf_mat, acc) = gue.manual_verification_disjoint(model, (x_test, y_test),
+                                    if g > 1 or stream_layout:
+                                        (cnf_mat, acc) = gue.manual_verification_disjoint(model, test_feed,
                                                                                           batch_size=b_size)
                                     else:
                                         # print(model.evaluate(x_test, y_test, batch_size=batch_size))
-                                        (cnf_mat, acc) = gue.manual_verification_100(model, (x_test, y_test),
+                                        (cnf_mat, acc) = gue.manual_verification_100(model, test_feed,
                                                                                      batch_size=b_size)
 
                                     '''
@@ -193,11 +208,8 @@ if __name__ == "__main__":
                                     save_result(directory + "/" + "stat.json", statJSON)
 
 
-                                    fold = None
-                                    x_train = None
-                                    y_train = None
-                                    x_test = None
-                                    y_test = None
+                                    train_feed = None
+                                    test_feed = None
 
                                     gc.collect()
 
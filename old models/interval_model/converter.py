@@ -2,23 +2,18 @@ import numpy as np
 import random
 
 
+# fields are read in groups of three ("start-end,task,<ignored>,") and every range is expanded with np.repeat
 def text_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
-
-    time_range = None
-    for i in range(len(raw_trace)):
-        if i%3 == 0:
-            raw_time_range = raw_trace[i].split("-")
-            time_range = (int(raw_time_range[0]),int(raw_time_range[1]))
-        elif i%3 == 1:
-            task_id = int(raw_trace[i])
-            for i in range(time_range[1] - time_range[0]):
-                trace.append(task_id)
-        else:
-            time_range = None
-    return trace
+    with open(fileName, 'r') as data_file:
+        raw_trace = data_file.readlines()[0].split(',')
+
+    raw_tasks = raw_trace[1::3]
+    raw_ranges = raw_trace[0::3][:len(raw_tasks)]
+    tasks = np.array([int(task) for task in raw_tasks], dtype=np.int64)
+    bounds = np.array([[int(bound) for bound in time_range.split("-")[:2]] for time_range in raw_ranges],
+                      dtype=np.int64).reshape(-1, 2)
+    durations = np.maximum(bounds[:, 1] - bounds[:, 0], 0)
+    return np.repeat(tasks, durations).tolist()
 
 '''
     This function assumes that labels are in a integer sequence from 0 to n. No skipping of a seuqence.
@@ -2,23 +2,18 @@ import numpy as np
 import random
 
 
+# fields are read in groups of three ("start-end,task,<ignored>,") and every range is expanded with np.repeat
 def text_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
+    with open(fileName, 'r') as data_file:
+        raw_trace = data_file.readlines()[0].split(',')
 
-    time_range = None
-    for i in range(len(raw_trace)):
-        if i%3 == 0:
-            raw_time_range = raw_trace[i].split("-")
-            time_range = (int(raw_time_range[0]),int(raw_time_range[1]))
-        elif i%3 == 1:
-            task_id = int(raw_trace[i])
-            for i in range(time_range[1] - time_range[0]):
-                trace.append(task_id)
-        else:
-            time_range = None
-    return trace
+    raw_tasks = raw_trace[1::3]
+    raw_ranges = raw_trace[0::3][:len(raw_tasks)]
+    tasks = np.array([int(task) for task in raw_tasks], dtype=np.int64)
+    bounds = np.array([[int(bound) for bound in time_range.split("-")[:2]] for time_range in raw_ranges],
+                      dtype=np.int64).reshape(-1, 2)
+    durations = np.maximum(bounds[:, 1] - bounds[:, 0], 0)
+    return np.repeat(tasks, durations).tolist()
 
 '''
     This function assumes that labels are in a integer sequence from 0 to n. No skipping of a seuqence.
@@ -50,26 +45,17 @@ def newText_to_list(fileName):
 def list_to_example_sequence(trace_list_old, label_card, offset=0, pred_len=1, seed=0):
     old_length = len(trace_list_old)
     trace_list = cut_random(trace_list_old, int(old_length * 0.1), int(old_length * 0.01), seed)
-    list_of_examples = []
-    list_of_labels = []
-    sequence_len = len(trace_list)
+    trace_list = np.asarray(trace_list, dtype=np.intp)
+    example_count = max(len(trace_list) - pred_len - offset - 1, 0)
 
+    list_of_examples = np.zeros((example_count, label_card))
+    list_of_examples[np.arange(example_count), trace_list[:example_count]] = 1
 
-    for i in range(sequence_len):
-        if i + pred_len + offset + 1>= len(trace_list):
-            break
-
-        example_datum = np.zeros(label_card)
-        example_datum[int(trace_list[i])] = 1
-        list_of_examples.append(example_datum)
-
-        label_datum = np.zeros(label_card * pred_len)
-
-        for j in range(pred_len):
-            task_num = trace_list[i + offset + j + 1]
-            label_datum[j*label_card + int(task_num)] = 1
-
-        list_of_labels.append(label_datum)
+    # row i of steps holds the ticks i + offset + 1 ... i + offset + pred_len, all labels are set in one scatter
+    rows = np.arange(example_count)[:, np.newaxis]
+    steps = rows + offset + 1 + np.arange(pred_len)
+    list_of_labels = np.zeros((example_count, label_card * pred_len))
+    list_of_labels[rows, np.arange(pred_len) * label_card + trace_list[steps]] = 1
 
     return (list_of_examples, list_of_labels)
 
@@ -1,40 +1,50 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import random
 import math
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import taskrecon_io as tio
+import taskrecon_store as store
+from taskrecon_trace import Trace
+import taskrecon_fold as fold
 
-def text_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
-
-    time_range = None
-    for i in range(len(raw_trace)):
-        if i%3 == 0:
-            raw_time_range = raw_trace[i].split("-")
-            time_range = (int(raw_time_range[0]),int(raw_time_range[1]))
-        elif i%3 == 1:
-            task_id = int(raw_trace[i])
-            for i in range(time_range[1] - time_range[0]):
-                trace.append(task_id)
-        else:
-            time_range = None
-    return trace
+
+'''
+    reads the "start-end,task," interval format. expand=False returns the run-length form (tasks, durations)
+    instead of the per-tick trace (see taskrecon_io.parse_interval_trace)
+'''
+def text_to_list(fileName, expand=True):
+    return tio.parse_interval_trace(fileName, expand)
+
+def text_to_trace(fileName):
+    return Trace(*tio.parse_interval_trace(fileName, expand=False))
 
 '''
     This function assumes that labels are in a integer sequence from 0 to n. No skipping of a seuqence.
 '''
 def detect_label_card(trace):
+    if isinstance(trace, Trace):
+        return trace.label_card()
+    if isinstance(trace, np.ndarray):
+        return len(np.unique(trace))
     dic = {}
     for tr in trace:
         dic[str(tr)]=1
     return len(dic)
 
-def readTraceFile(fileName):
-    data_file = open(fileName, 'r')
-    sequences = data_file.readlines()[0].split(',')
-    trace = list(map(int, list(map(str.strip,sequences))))
-    return trace
+'''
+    returns trace[start:stop] as a compact integer array. after the first full load it is read from the binary
+    sidecar, and a bounded range is streamed without parsing the rest of the file (see taskrecon_io)
+'''
+def readTraceFile(fileName, start=0, stop=None):
+    return tio.load_comma_trace(fileName, start, stop)
+
+# length, labels, label_card, histogram, runs and hash of the whole file (see taskrecon_store.trace_manifest)
+def readTraceManifest(fileName):
+    return store.trace_manifest(fileName)
 
 '''
     This function requires the time
@@ -48,7 +58,7 @@ def readTraceFile(fileName):
 
     keeping the gap==offset makes X[1] == Y[0]
 '''
-def list_to_example_regression(trace_X, trace_Y, timesteps = 1, offset=0, pred_len=1, seed=0):
+def list_to_example_regression(trace_X, trace_Y, timesteps = 1, offset=0, pred_len=1, seed=0, dtype=np.float64):
     # old_length = len(trace_X)
     # trace_X = cut_random(trace_X, int(old_length * 0.1), int(old_length * 0.01), seed)
     # trace_Y = cut_random(trace_Y, int(old_length * 0.1), int(old_length * 0.01), seed)
@@ -57,94 +67,64 @@ def list_to_example_regression(trace_X, trace_Y, timesteps = 1, offset=0, pred_l
         print("THE LIST LENGTH IS DIFFERENT")
         return
 
-    list_of_examples = []
-    list_of_labels = []
-    sequence_len = len(trace_X)
+    # a single feature per tick, the (traceLength, 1) columns regression_trace returns are flattened
+    trace_X = np.reshape(np.asarray(trace_X), (len(trace_X),))
+    trace_Y = np.reshape(np.asarray(trace_Y), (len(trace_Y),))
+    example_count = max(len(trace_X) - pred_len - timesteps - offset - 1, 0)
 
+    # written straight into preallocated arrays of dtype (float32 or float16 for the regression features)
+    list_of_examples = np.empty((example_count, timesteps), dtype=dtype)
+    list_of_labels = np.empty((example_count, 1), dtype=dtype)
+    if example_count == 0:
+        return (list_of_examples, list_of_labels)
 
-    for i in range(sequence_len):
-        if i + pred_len + timesteps + offset + 1>= len(trace_X):
-            break
-        example_datum = np.zeros(timesteps)
-        for j in range(timesteps):
-            example_datum[j] = trace_X[i+j]
-        list_of_examples.append(example_datum)
-
-        label_datum = np.zeros(1)
-        for j in range(1):
-            prediction_value = trace_Y[i + offset + j]
-            label_datum[j] = prediction_value
-
-        list_of_labels.append(label_datum)
-
-    if len(list_of_examples) != len(list_of_labels):
-        print("THE LIST LENGTH IS DIFFERENT")
-        return
-
+    list_of_examples[:] = sliding_window_view(trace_X, timesteps)[:example_count]
+    list_of_labels[:, 0] = trace_Y[offset:offset + example_count]
 
     return (list_of_examples, list_of_labels)
 
+# (count, timesteps, features) windows of trace along its first axis, window i starts at row start + i.
+# the features of a row are flattened, a (traceLength, 1, 2) trace gives (timesteps, 2) windows
+def window_rows(trace, timesteps, start, count):
+    trace = np.reshape(trace, (len(trace), -1))
+    if count <= 0:
+        return np.zeros((0, timesteps, trace.shape[1]), dtype=trace.dtype)
+    windows = sliding_window_view(trace, timesteps, axis=0)[start:start + count]
+    return np.moveaxis(windows, -1, 1)
+
 # expects the trace_x to have shape (traceLength, 2)
 # expects the trace_y to have shape (traceLength, 1)
-def organizeTraceManyMultSingUni(trace_X, trace_Y, timesteps, offset):
+# example i is trace_X[i:i+timesteps], its label trace_Y[i+offset+1] (every column, (N, 1) for a (traceLength, 1) Y)
+def organizeTraceManyMultSingUni(trace_X, trace_Y, timesteps, offset, dtype=np.float64):
     if len(trace_X) != len(trace_Y):
         print("THE INPUT LIST LENGTH IS DIFFERENT: X= {}, Y= {}".format(len(trace_X),len(trace_Y)))
         return
 
-    exampleList = []
-    labelList = []
-    sequenceLength = len(trace_X)
-
-    for i in range(sequenceLength):
-        if i + timesteps + offset + 1>= len(trace_X):
-            break
-
-        example_datum = np.zeros((timesteps, 2))
-        for j in range(timesteps):
-            example_datum[j] = trace_X[i+j]
-        exampleList.append(example_datum)
+    trace_X = np.asarray(trace_X)
+    trace_Y = np.asarray(trace_Y)
+    exampleCount = max(len(trace_X) - timesteps - offset - 1, 0)
 
-        label_datum = np.zeros(1)
-        prediction_value = trace_Y[i + offset + 1][0]
-        label_datum[0] = prediction_value
-        labelList.append(label_datum)
-
-    if len(exampleList) != len(labelList):
-        print("THE LIST LENGTH IS DIFFERENT")
-        return
+    # one contiguous copy of the strided windows, no per-example arrays
+    exampleList = np.array(window_rows(trace_X, timesteps, 0, exampleCount), dtype=dtype)
+    labelList = np.array(np.reshape(trace_Y, (len(trace_Y), -1))[offset + 1:offset + 1 + exampleCount], dtype=dtype)
 
     return exampleList, labelList
 
 # expects the trace_x to have shape (traceLength, 2)
 # expects the trace_y to have shape (traceLength, 1)
 # expects the labelList to have shape (batch, timeseries, 1)
-def organizeTraceManyMultManyUni(trace_X, trace_Y, timesteps, offset):
+# example i is trace_X[i:i+timesteps], its labels trace_Y[i+offset+1:i+offset+1+timesteps]
+def organizeTraceManyMultManyUni(trace_X, trace_Y, timesteps, offset, dtype=np.float64):
     if len(trace_X) != len(trace_Y):
         print("THE INPUT LIST LENGTH IS DIFFERENT: X= {}, Y= {}".format(len(trace_X),len(trace_Y)))
         return
 
-    exampleList = []
-    labelList = []
-    sequenceLength = len(trace_X)
+    trace_X = np.asarray(trace_X)
+    trace_Y = np.asarray(trace_Y)
+    exampleCount = max(len(trace_X) - timesteps - offset - 1, 0)
 
-    for i in range(sequenceLength):
-        if i + timesteps + offset + 1>= len(trace_X):
-            break
-
-        example_datum = np.zeros((timesteps, 2))
-        for j in range(timesteps):
-            example_datum[j] = trace_X[i+j]
-        exampleList.append(example_datum)
-
-        label_datum = np.zeros((timesteps, 1))
-        for j in range(timesteps):
-            prediction_value = trace_Y[i + offset + 1 + j][0]
-            label_datum[j] = prediction_value
-        labelList.append(label_datum)
-
-    if len(exampleList) != len(labelList):
-        print("THE LIST LENGTH IS DIFFERENT")
-        return
+    exampleList = np.array(window_rows(trace_X, timesteps, 0, exampleCount), dtype=dtype)
+    labelList = np.array(window_rows(trace_Y, timesteps, offset + 1, exampleCount), dtype=dtype)
 
     return exampleList, labelList
 
@@ -156,7 +136,8 @@ def cut_random(trace, upper_bound, lower_bound, seed=0):
     return trace[offset:]
 
 
-def chunk_examples(examples, labels, start_index, end_index):
+# dtype is the type of the returned chunk, float32 by default. an array already in dtype is sliced without a copy
+def chunk_examples(examples, labels, start_index, end_index, dtype=np.float32):
     chunk_size = end_index-start_index
     if chunk_size < 1:
         raise ValueError("chrunk_size has value of " + str(chunk_size))
@@ -164,33 +145,30 @@ def chunk_examples(examples, labels, start_index, end_index):
     example_chunk = examples[start_index:end_index]
     label_fold = labels[start_index:end_index]
 
-    label_dataset= np.asarray(label_fold, dtype=np.float32)
-    example_dataset = np.asarray(example_chunk, dtype=np.float32)
+    label_dataset= np.asarray(label_fold, dtype=dtype)
+    example_dataset = np.asarray(example_chunk, dtype=dtype)
 
     return example_dataset, label_dataset
 
 
 def mySim_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
-
+    return tio.load_cached(fileName, tio.parse_comma_trace)
 
-    for i in range(len(raw_trace)):
-        trace.append(int(raw_trace[i]))
-    return trace
+# taskrecon_fold.Fold of index ranges, train and test are only materialized when used (by chunk_examples above)
+def split_fold(ratio, data_pair, dtype=np.float32):
+    return fold.ratio_fold(ratio, data_pair, dtype, chunk_examples)
 
-def split_train_test(ratio, data_pair):
+def split_train_test(ratio, data_pair, dtype=np.float32):
     example_list = data_pair[0]
     label_list = data_pair[1]
-    train_max_ind =  int(len(example_list) * ratio)
 
     print(len(example_list))
     print(len(label_list))
     if len(example_list) != len(label_list):
         raise ValueError("expected example and label to have same number of samples")
 
-    train_x, train_y = chunk_examples(example_list, label_list, 0, train_max_ind)
-    test_x, test_y = chunk_examples(example_list, label_list, train_max_ind+1, len(example_list)-1)
+    train, test = split_fold(ratio, data_pair, dtype)
+    train_x, train_y = train
+    test_x, test_y = test
 
     return train_x, train_y, test_x, test_y
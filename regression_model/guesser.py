@@ -16,11 +16,12 @@ import os
 from pathlib2 import Path
 from keras import backend as K
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import MinMaxScaler
 
 
-# turns trace into binary vector
+# turns trace into binary vector. a Trace is masked run by run and stays run-length encoded
 def mask_trace(value, trace):
+    if isinstance(trace, cvt.Trace):
+        return trace.mask(value)
     output_trace = []
     for i in range(len(trace)):
         val = trace[i]
@@ -31,16 +32,71 @@ def mask_trace(value, trace):
     return output_trace
 
 
+# keeps the ticks at 1 mod sample_gap as a strided view of the trace (a Trace is expanded once). a gap of 1 keeps
+# nothing, i % 1 is never 1
 def uniform_sample_trace(sample_gap, trace):
-    output_trace = []
-    for i in range(len(trace)):
-        if i % sample_gap == 1:
-            output_trace.append(trace[i])
-    return output_trace
+    if sample_gap == 1:
+        return np.asarray(trace)[:0]
+    if isinstance(trace, cvt.Trace):
+        return trace[1::sample_gap]
+    return np.asarray(trace)[1::sample_gap]
+
+
+'''
+    Downsampled versions of one trace for coarse-resolution experiments. For g > 1 level g keeps the same ticks as
+    uniform_sample_trace(g, trace) (1 mod g); level 1 is the whole trace, where uniform_sample_trace(1, trace) keeps
+    nothing. The trace is expanded once and every level is a strided view of it, so building and keeping the whole
+    pyramid costs nothing beyond the trace and the preprocessing of a level scales with its own length (1/g of the
+    trace).
+'''
+class DecimationPyramid:
+
+    def __init__(self, trace, gaps=(1, 2, 5, 10)):
+        self.ticks = np.asarray(trace)
+        self.levels = {}
+        for gap in gaps:
+            self.level(gap)
+
+    def gaps(self):
+        return sorted(self.levels)
+
+    def level(self, gap):
+        if gap not in self.levels:
+            self.levels[gap] = self.ticks if gap == 1 else self.ticks[1::gap]
+        return self.levels[gap]
+
+    def __getitem__(self, gap):
+        return self.level(gap)
 
 # output two vectors: one for X and the other for Y
-
-def regression_trace(trace):
+# the first element is skipped, the ramps start at trace[1]. scale=False returns the integer ramps (int64, shape (n - 1,))
+# instead of the two (n - 1, 1) scaled ones. a pipeline scales them as in scale_ramps
+def regression_trace(trace, scale=True, pipeline=None):
+    if isinstance(trace, cvt.Trace):
+        X, Y = run_ramps(trace[1:])
+    else:
+        # runs are found with np.diff / np.flatnonzero (Trace.from_ticks) instead of grouping tick by tick, on signed
+        # ticks: readTraceFile returns compact uint8 arrays
+        X, Y = run_ramps(cvt.Trace.from_ticks(np.asarray(trace, dtype=np.int64)[1:]))
+
+    if not scale:
+        return X, Y
+    return scale_ramps(X, Y, pipeline)
+
+
+# elapsed and remaining ramps of every run of a Trace, the values regression_trace builds group by group
+def run_ramps(trace):
+    # signed first: mask traces are uint8 and -1 would wrap around
+    states = trace.tasks.astype(np.int64)
+    states[states == 0] = -1
+    state = np.repeat(states, trace.durations)
+    run_len = np.repeat(trace.durations, trace.durations)
+    j = np.arange(len(trace)) - np.repeat(trace.starts, trace.durations)
+    return -j * state, -state * (run_len - j)
+
+
+# the elapsed and remaining ramps of trace[1:] built run by run, the way regression_trace used to
+def group_ramps(trace):
     X = []
     Y = []
     group_lists = []
@@ -61,18 +117,263 @@ def regression_trace(trace):
 
     for i in range(len(group_lists)):
         group = group_lists[i]
-        group_state = group[0]
+        group_state = int(group[0])
         if group_state == 0:
             group_state = -1
         for j in range(len(group)):
             X.append((-j * group_state))
             Y.append(-group_state * (len(group) - j))
 
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    X_scaled = scaler.fit_transform(np.reshape(X, (len(X), 1)))
-    Y_scaled = scaler.fit_transform(np.reshape(Y, (len(Y), 1)))
-
-    return X_scaled, Y_scaled
+    return X, Y
+
+''' compares the vectorized ramps of trace, as a Trace and as a list, with group_ramps. 0 when they all match'''
+def validate_ramps(trace):
+    ticks = [int(tick) for tick in trace]
+    expected = group_ramps(ticks)
+    for name, value in (("list", ticks), ("Trace", cvt.Trace.from_ticks(np.asarray(trace)))):
+        X, Y = regression_trace(value, scale=False)
+        if not (np.array_equal(X, expected[0]) and np.array_equal(Y, expected[1])):
+            print("ERROR")
+            print(name + " ramps differ from the group loop")
+            print("X: " + str(X) + " expected: " + str(expected[0]))
+            print("Y: " + str(Y) + " expected: " + str(expected[1]))
+            return -1
+    return 0
+
+
+# scaled (n, 1) elapsed and remaining ramps. without a pipeline both are fitted on the ramps themselves
+def scale_ramps(X, Y, pipeline=None):
+    if pipeline is None:
+        pipeline = FeaturePipeline()
+    X = np.reshape(X, (len(X), 1))
+    Y = np.reshape(Y, (len(Y), 1))
+    if not pipeline.fitted():
+        pipeline.fit(X, Y)
+
+    return pipeline.transform(X, Y)
+
+
+'''
+    Column-wise min-max scaling to [0, 1] with the arithmetic of sklearn's MinMaxScaler (x * scale + min, constant
+    columns get a scale of 1). Only the minimum and maximum of every column are kept, so partial_fit folds in a
+    block of samples in O(1) per sample and column, and a stream can be scaled sample by sample.
+    X is (samples, features); a 1-d X is one sample (a TaskFeatureStream.push row), the way MinMaxScaler reads a row.
+'''
+class FeatureScaler:
+
+    def __init__(self):
+        self.data_min = None
+        self.data_max = None
+
+    def fitted(self):
+        return self.data_min is not None
+
+    # X as (samples, features), checked against the features the scaler was fitted on
+    def samples(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        X = np.atleast_2d(X) if X.ndim < 2 else np.reshape(X, (len(X), -1))
+        if self.fitted() and X.shape[1] != len(self.data_min):
+            raise ValueError("expected " + str(len(self.data_min)) + " features, got " + str(X.shape[1]))
+        return X
+
+    def partial_fit(self, X):
+        X = self.samples(X)
+        if len(X) == 0:
+            return self
+        if self.data_min is None:
+            self.data_min = X.min(axis=0)
+            self.data_max = X.max(axis=0)
+        else:
+            self.data_min = np.minimum(self.data_min, X.min(axis=0))
+            self.data_max = np.maximum(self.data_max, X.max(axis=0))
+        return self
+
+    def fit(self, X):
+        self.data_min = None
+        self.data_max = None
+        return self.partial_fit(X)
+
+    def transform(self, X):
+        if not self.fitted():
+            raise ValueError("the scaler has not been fitted")
+        data_range = self.data_max - self.data_min
+        scale = 1.0 / np.where(data_range == 0, 1.0, data_range)
+        shape = np.shape(X)
+        X = self.samples(X)
+        return np.reshape(X * scale + (-self.data_min * scale), shape)
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def to_dict(self):
+        return {"data_min": self.data_min.tolist(), "data_max": self.data_max.tolist()}
+
+    @staticmethod
+    def from_dict(data):
+        scaler = FeatureScaler()
+        scaler.data_min = np.asarray(data["data_min"], dtype=np.float64)
+        scaler.data_max = np.asarray(data["data_max"], dtype=np.float64)
+        return scaler
+
+
+'''
+    The scaling of the elapsed (X) and remaining (Y) ramps of a dataset, one FeatureScaler each (one column per task
+    for task_features). Fitted once on the training trace and saved next to the model (pipeline_name), so inference
+    and later runs reuse the training scaling instead of refitting on whatever trace they see.
+'''
+class FeaturePipeline:
+
+    def __init__(self):
+        self.elapsed = FeatureScaler()
+        self.remaining = FeatureScaler()
+
+    def fitted(self):
+        return self.elapsed.fitted()
+
+    # remaining may be left out, e.g. on a live stream where only the elapsed ramps are known
+    def partial_fit(self, elapsed, remaining=None):
+        self.elapsed.partial_fit(elapsed)
+        if remaining is not None:
+            self.remaining.partial_fit(remaining)
+        return self
+
+    def fit(self, elapsed, remaining=None):
+        self.elapsed.fit(elapsed)
+        if remaining is not None:
+            self.remaining.fit(remaining)
+        return self
+
+    # scaled elapsed, or (elapsed, remaining) when both are given
+    def transform(self, elapsed, remaining=None):
+        if remaining is None:
+            return self.elapsed.transform(elapsed)
+        return self.elapsed.transform(elapsed), self.remaining.transform(remaining)
+
+    def save(self, fileName):
+        data = {"elapsed": self.elapsed.to_dict(), "remaining": None}
+        if self.remaining.fitted():
+            data["remaining"] = self.remaining.to_dict()
+        save_result(fileName, data)
+
+    @staticmethod
+    def load(fileName):
+        with open(fileName, "r") as file:
+            data = json.load(file)
+        pipeline = FeaturePipeline()
+        pipeline.elapsed = FeatureScaler.from_dict(data["elapsed"])
+        if data["remaining"] is not None:
+            pipeline.remaining = FeatureScaler.from_dict(data["remaining"])
+        return pipeline
+
+
+# size15rep0/c64_e10_....model -> size15rep0/c64_e10_....scaler.json
+def pipeline_name(modelname):
+    if modelname.endswith(".model"):
+        modelname = modelname[:-len(".model")]
+    return modelname + ".scaler.json"
+
+
+# the pipeline saved with the model, or a new unfitted one
+def load_pipeline(modelname):
+    if file_exists(pipeline_name(modelname)):
+        return FeaturePipeline.load(pipeline_name(modelname))
+    return FeaturePipeline()
+
+
+'''
+    mask_trace + regression_trace for every task at once, one column per task:
+        mask        (n - 1, label_card) 1 where the task runs, the binaryTrace[:len(regressionTrace)] of mask_trace
+        elapsed     (n - 1, label_card) scaled elapsed ramp of the task's runs, regression_trace's X
+        remaining   (n - 1, label_card) scaled remaining ramp, regression_trace's Y
+    the ramps follow the runs of every mask column: a run starts wherever the column changes, so one pass over the
+    (n - 1, label_card) matrix replaces label_card passes over the trace. columns are scaled independently, the same
+    as one MinMaxScaler per task. an unfitted pipeline is fitted on this trace (keep it to save it with the model), a
+    fitted one is only applied.
+'''
+def task_features(trace, label_card, dtype=np.float32, pipeline=None):
+    trace = np.asarray(trace)
+    mask = np.zeros((len(trace) - 1, label_card), dtype=bool)
+    mask[np.arange(len(trace) - 1), trace[:-1]] = True
+
+    running = np.zeros((len(trace) - 1, label_card), dtype=bool)
+    running[np.arange(len(trace) - 1), trace[1:]] = True
+
+    tick_count = len(running)
+    rows = np.arange(tick_count)[:, np.newaxis]
+    change = np.ones(running.shape, dtype=bool)
+    change[1:] = running[1:] != running[:-1]
+
+    # first tick of the run holding every tick, and first tick after it
+    starts = np.maximum.accumulate(np.where(change, rows, 0), axis=0)
+    ends = np.full(running.shape, tick_count)
+    ends[:-1] = np.minimum.accumulate(np.where(change, rows, tick_count)[::-1], axis=0)[::-1][1:]
+
+    state = np.where(running, 1, -1)
+    elapsed = -(rows - starts) * state
+    remaining = -state * (ends - rows)
+
+    if pipeline is None:
+        pipeline = FeaturePipeline()
+    if not pipeline.fitted():
+        pipeline.fit(elapsed, remaining)
+    elapsed, remaining = pipeline.transform(elapsed, remaining)
+    return mask.astype(dtype), elapsed.astype(dtype), remaining.astype(dtype)
+
+
+'''
+    Online version of task_features for a live trace: ticks are pushed one at a time or in blocks and every new tick
+    gives the (mask, elapsed) row task_features would give for it, unscaled. Only the per-task run state is kept
+    (which tasks run, where their current run started), so a tick costs O(label_card) however long the stream gets.
+    Like task_features, the first tick only primes the stream: row r holds the mask of tick r and the elapsed ramps of
+    tick r + 1. The remaining ramp is not produced, it is only known once a run has ended (it is the training label).
+'''
+class TaskFeatureStream:
+
+    def __init__(self, label_card):
+        self.label_card = label_card
+        self.previous = None
+        self.tick = -1
+        self.running = np.zeros(label_card, dtype=bool)
+        self.run_start = np.zeros(label_card, dtype=np.int64)
+
+    # (mask, elapsed) rows of the pushed ticks, shape (rows, label_card) int64
+    def push_block(self, ticks):
+        ticks = np.asarray(ticks, dtype=np.int64)
+        if len(ticks) > 0 and self.previous is None:
+            self.previous = ticks[0]
+            ticks = ticks[1:]
+        row_count = len(ticks)
+        if row_count == 0:
+            empty = np.zeros((0, self.label_card), dtype=np.int64)
+            return empty, empty
+
+        previous = np.concatenate(([self.previous], ticks[:-1]))
+        mask = np.zeros((row_count, self.label_card), dtype=np.int64)
+        mask[np.arange(row_count), previous] = 1
+        running = np.zeros((row_count, self.label_card), dtype=bool)
+        running[np.arange(row_count), ticks] = True
+
+        # a run starts wherever a task starts or stops running, the first row starts every run
+        rows = self.tick + 1 + np.arange(row_count)
+        change = np.empty(running.shape, dtype=bool)
+        change[0] = True if self.tick < 0 else running[0] != self.running
+        change[1:] = running[1:] != running[:-1]
+        starts = np.maximum.accumulate(np.vstack((self.run_start, np.where(change, rows[:, np.newaxis], -1))),
+                                       axis=0)[1:]
+        elapsed = -(rows[:, np.newaxis] - starts) * np.where(running, 1, -1)
+
+        self.tick = rows[-1]
+        self.running = running[-1]
+        self.run_start = starts[-1]
+        self.previous = ticks[-1]
+        return mask, elapsed
+
+    # (mask, elapsed) row of one tick, None for the first tick of the stream
+    def push(self, task):
+        mask, elapsed = self.push_block([task])
+        if len(mask) == 0:
+            return None
+        return mask[0], elapsed[0]
 
 
 def save_result(fileName, data_dict):
@@ -242,16 +543,18 @@ def run_instance(data_name, cell_size=32, layers=1, epoch=50, batch_size=32, pre
     masked_try = []
     masked_tex = []
     masked_tey = []
+    # sampled once instead of once per task, masking and sampling commute
+    sampled_trace = uniform_sample_trace(5, original_trace)
     for t in range(label_card):
         print("processing task " + str(t))
-        trace = mask_trace(t, original_trace)
-        trace = uniform_sample_trace(5, trace)
+        trace = mask_trace(t, sampled_trace)
         trace = trace[100:1000000]
         print(trace)
         trace_X, trace_Y = regression_trace(trace)
 
         example = cvt.list_to_example_regression(
-            trace_X, trace_Y, timesteps=timesteps, offset=offset + timesteps, pred_len=prediction_len, seed=data_name)
+            trace_X, trace_Y, timesteps=timesteps, offset=offset + timesteps, pred_len=prediction_len, seed=data_name,
+            dtype=np.float32)
 
         train_x, train_y, test_x, test_y = cvt.split_train_test(
             0.80, example, timesteps=timesteps)
@@ -104,26 +104,13 @@ def weighted_categorical_crossentropy(weights):
         return loss
     return loss
 
-def get_priors(trace):
-    prior_count = {}
-    normalized = {}
-    inverse = {}
-    for i in trace:
-        if i in prior_count:
-            prior_count[i] += 1
-        else:
-            prior_count[i] = 1
-    total = 0
-
-
-
-    for key, value in prior_count.items():
-        normalized[key] = float(value/len(trace))
-        inverse[key] = float(len(trace)/value)
+def get_priors(trace, histogram=None):
+    if histogram is None:
+        histogram = np.bincount(np.asarray(trace))
+    counts = np.asarray(histogram)
+    counts = counts[counts > 0]
 
-    inverse_output = np.zeros(len(inverse))
-    for key, value in inverse.items():
-        inverse_output[key] = value
+    inverse_output = float(np.sum(counts)) / counts
 
     return None, inverse_output
 
@@ -152,13 +139,12 @@ if __name__ == "__main__":
 
     for fileName in fileNames:
 
-        label_card = gue.tasksize_extractor(fileName)+1
+        label_card = cvt.readTraceManifest(fileName)["label_range"]
 
         modelExists = False
 
         result_path, modelname, statname = makeFilenames(fileName, cell_size, epoch, batchSize, timesteps, offset)
-        originalTrace= cvt.readTraceFile(fileName)
-        originalTrace = originalTrace[100:]
+        originalTrace= cvt.readTraceFile(fileName, 100)
         # originalTrace = cvt.cut_random(originalTrace, 0.1, 0.01, fileName)
         # trim the first couple of sequence of original trace
         _, inverse = get_priors(originalTrace)
@@ -166,38 +152,18 @@ if __name__ == "__main__":
         if gue.file_exists(modelname):
             modelExists = True
 
-        train_X = []
-        train_Y = []
-        test_X = []
-        test_Y = []
-
-        for t in range(label_card):
-            print("processing task " + str(t))
-            binaryTrace = gue.mask_trace(t, originalTrace)
-            # trace = gue.uniform_sample_trace(5, trace)
-            # trace = trace[100:1000000]
-
-            regressionTrace, trace_Y = gue.regression_trace(binaryTrace)
-            binaryTrace = binaryTrace[:len(regressionTrace)]
-            binaryTrace = np.reshape(binaryTrace, (len(binaryTrace), 1))
-            trace_X = [regressionTrace, binaryTrace]
-            trace_X = np.stack(trace_X, axis=-1)  #<---- ISSUE WITH FORMATTING
-
-
+        # the scaling saved with an existing model, otherwise fitted here and saved with the new model
+        pipeline = gue.load_pipeline(modelname)
 
-            example = cvt.organizeTraceManyMultSingUni(
-                trace_X, binaryTrace, timesteps, offset + timesteps)
+        # elapsed ramps and masks of every task in one pass, laid out per tick as [elapsed of all tasks, masks of
+        # all tasks] (the order the per-task features were stacked in). the masks are the labels
+        mask, elapsed, remaining = gue.task_features(originalTrace, label_card, pipeline=pipeline)
+        trace_X = np.concatenate([elapsed, mask], axis=-1)
 
-            taskTrain_X, taskTrain_Y, taskTest_X, taskTest_Y = cvt.split_train_test(trainSplit, example)
-            train_X.append(taskTrain_X)
-            train_Y.append(taskTrain_Y)
-            test_X.append(taskTest_X)
-            test_Y.append(taskTest_Y)
+        example = cvt.organizeTraceManyMultSingUni(
+            trace_X, mask, timesteps, offset + timesteps, dtype=np.float32)
 
-        train_X = np.stack(train_X, axis=-1)
-        train_Y = np.stack(train_Y, axis=-1)
-        test_X = np.stack(test_X, axis=-1)
-        test_Y = np.stack(test_Y, axis=-1)
+        train_X, train_Y, test_X, test_Y = cvt.split_train_test(trainSplit, example)
 
         total_len = len(train_X)
         total_len -= total_len % batchSize
@@ -249,6 +215,7 @@ if __name__ == "__main__":
 
             # TODO:
             model.save(modelname)
+            pipeline.save(gue.pipeline_name(modelname))
 
             scores = model.evaluate(test_X, test_Y, batch_size=batchSize, verbose=2)
             model.reset_states()
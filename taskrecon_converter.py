@@ -1,45 +1,50 @@
 #from keras.datasets import imdb
 import numpy as np
-import math
 from multiprocessing import pool
 import copy
+import taskrecon_io as tio
+import taskrecon_store as store
+from taskrecon_trace import Trace, as_ticks
+import taskrecon_window as win
+import taskrecon_fold as fold
 
 # assume 2d array
 # def printNumpy(array):
 
 
-def text_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
-
-    time_range = None
-    for i in range(len(raw_trace)):
-        if i%3 == 0:
-            raw_time_range = raw_trace[i].split("-")
-            time_range = (int(raw_time_range[0]),int(raw_time_range[1]))
-        elif i%3 == 1:
-            task_id = int(raw_trace[i])
-            for i in range(time_range[1] - time_range[0]):
-                trace.append(task_id)
-        else:
-            time_range = None
-    return trace
+'''
+    reads the "start-end,task," interval format. expand=False returns the run-length form (tasks, durations)
+    instead of the per-tick trace (see taskrecon_io.parse_interval_trace)
+'''
+def text_to_list(fileName, expand=True):
+    return tio.parse_interval_trace(fileName, expand)
+
+def text_to_trace(fileName):
+    return Trace(*tio.parse_interval_trace(fileName, expand=False))
 
 '''
     This function assumes that labels are in a integer sequence from 0 to n. No skipping of a seuqence.
 '''
 def detect_label_card(trace):
+    if isinstance(trace, Trace):
+        return trace.label_card()
+    if isinstance(trace, np.ndarray):
+        return len(np.unique(trace))
     dic = {}
     for tr in trace:
         dic[str(tr)]=1
     return len(dic)
 
-def newText_to_list(fileName):
-    data_file = open(fileName, 'r')
-    sequences = data_file.readlines()[0].split(',')
-    trace = list(map(int, list(map(str.strip,sequences))))
-    return trace
+'''
+    returns trace[start:stop] as a compact integer array. after the first full load it is read from the binary
+    sidecar, and a bounded range is streamed without parsing the rest of the file (see taskrecon_io)
+'''
+def newText_to_list(fileName, start=0, stop=None):
+    return tio.load_comma_trace(fileName, start, stop)
+
+# length, labels, label_card, histogram, runs and hash of the whole file (see taskrecon_store.trace_manifest)
+def trace_manifest(fileName):
+    return store.trace_manifest(fileName)
 
 '''
     input is of shape (time_steps, label_card)
@@ -52,26 +57,22 @@ def newText_to_list(fileName):
     p     -       d     tstepsOffset+
     s      -
 '''
-def list_to_example(trace_list, label_card, time_steps, label_size=1, offset=0):
-    list_of_examples = []
-    list_of_labels = []
-    for i in range(len(trace_list)):
-        if i + time_steps+offset+label_size >= len(trace_list):
-            break
-
-        # squash the mutiple steps
-        example_datum = np.zeros((time_steps,label_card))
-        for j in range(time_steps):
-            task_num = trace_list[j+i]
-            example_datum[j][int(task_num)] = 1
-        list_of_examples.append(example_datum)
-
-        label_datum = np.zeros((time_steps, label_card))
-        for j in range(label_size):
-            task_num = trace_list[i + time_steps + offset + j]
-            label_datum[j][int(task_num)] = 1
+def list_to_example(trace_list, label_card, time_steps, label_size=1, offset=0, dtype=np.float64):
+    trace_list = np.asarray(as_ticks(trace_list))
+    example_count = max(len(trace_list) - time_steps - offset - label_size, 0)
+
+    # written straight into preallocated arrays of dtype (uint8 or bool is enough for one-hot)
+    list_of_examples = np.zeros((example_count, time_steps, label_card), dtype=dtype)
+    list_of_labels = np.zeros((example_count, time_steps, label_card), dtype=dtype)
+    if example_count == 0:
+        return (list_of_examples, list_of_labels)
+
+    windows = win.window_view(trace_list, time_steps, 0, example_count).astype(np.intp)
+    np.put_along_axis(list_of_examples, windows[..., np.newaxis], 1, axis=-1)
 
-        list_of_labels.append(label_datum)
+    rows = np.arange(example_count)
+    for j in range(label_size):
+        list_of_labels[rows, j, trace_list[rows + time_steps + offset + j].astype(np.intp)] = 1
 
     return (list_of_examples, list_of_labels)
 
@@ -87,33 +88,24 @@ def list_to_example(trace_list, label_card, time_steps, label_size=1, offset=0):
     s      -      s      gapOffset+
     
     keeping the gap==offset makes X[1] == Y[0]
-'''
-def list_to_example_overlap(trace_list, time_steps=100, offset=0, overlap_gap=1):
-
-    label_card = detect_label_card(trace_list)
-    list_of_examples = []
-    list_of_labels = []
 
-    #  TODO: PARALLZELIZE THIS, OR MAY BE NOT. THE PROBLEM WAS DUE TO LACK OF MEM
-    for i in range(len(trace_list)):
-        if i + time_steps+overlap_gap+offset >= len(trace_list):
-            break
-
-        # squash the mutiple steps
-        example_datum = np.zeros((time_steps, label_card))
-        for j in range(time_steps):
-            task_num = trace_list[j + i]
-            example_datum[j][int(task_num)] = 1
-        list_of_examples.append(example_datum)
+    returns lazily one-hot encoded views (taskrecon_window.OneHotView) that index like the old lists of arrays and
+    materialize in dtype unless chunk_examples asks for another one.
+    one_hot=False returns the examples as (N, time_steps) integer task ids instead, for Embedding inputs.
+    sparse_labels=True does the same for the labels, for sparse_categorical_crossentropy
+'''
+def list_to_example_overlap(trace_list, time_steps=100, offset=0, overlap_gap=1, label_card=None, one_hot=True,
+                            sparse_labels=False, dtype=np.float64):
 
-        label_datum = np.zeros((time_steps, label_card))
-        for j in range(time_steps):
-            task_num = trace_list[i + offset+ overlap_gap + j]
-            label_datum[j][int(task_num)] = 1
+    if label_card is None:
+        label_card = detect_label_card(trace_list)
 
-        list_of_labels.append(label_datum)
+    # X and Y are strided int views over one encoded copy of the trace. one-hot happens when a chunk is materialized
+    dataset = win.WindowDataset(trace_list, time_steps, offset, overlap_gap, label_card, dtype)
 
-    return (list_of_examples, list_of_labels)
+    examples = dataset.X if one_hot else dataset.example_indices()
+    labels = dataset.label_indices() if sparse_labels else dataset.Y
+    return (examples, labels)
 
 
 '''
@@ -129,34 +121,23 @@ def list_to_example_overlap(trace_list, time_steps=100, offset=0, overlap_gap=1)
     keeping the gap==offset makes X[1] == Y[0]
 '''
 
-def list_to_example_sequence(trace_list, offset=0, pred_len=1):
-    label_card = detect_label_card(trace_list)
-    list_of_examples = []
-    list_of_labels = []
-    sequence_len = len(trace_list)
-
-
-    #  TODO: PARALLZELIZE THIS, OR MAY BE NOT. THE PROBLEM WAS DUE TO LACK OF MEM
-    for i in range(sequence_len):
-        if i + sequence_len + pred_len + offset >= len(trace_list):
-            break
-
-        example_datum = np.zeros(label_card)
-        example_datum[int(trace_list[i])] = 1
-        list_of_examples.append(example_datum)
+def list_to_example_sequence(trace_list, offset=0, pred_len=1, label_card=None, dtype=np.float64):
+    if label_card is None:
+        label_card = detect_label_card(trace_list)
+    trace_list = np.asarray(as_ticks(trace_list))
+    example_count = max(len(trace_list) - pred_len - offset - 1, 0)
 
-        label_datum = np.zeros(label_card * pred_len)
-
-        for j in range(pred_len):
-            task_num = trace_list[i + offset + j + 1]
-            label_datum[j * label_card + int(task_num)] = 1
-
-        list_of_labels.append(label_datum)
+    list_of_examples = win.one_hot(trace_list[:example_count], label_card, dtype)
+    list_of_labels = win.sequence_targets(trace_list, label_card, offset + 1, pred_len, example_count, dtype)
 
     return (list_of_examples, list_of_labels)
 
 
-def chunk_examples(examples, labels, start_index, end_index):
+'''
+    dtype is the type of the materialized chunk: float32 for keras, uint8 or bool to keep one-hot chunks small.
+    labels without the one-hot axis of the examples are sparse task ids and stay integers (taskrecon_window.is_sparse).
+'''
+def chunk_examples(examples, labels, start_index, end_index, dtype=np.float32):
     if len(examples) != len(labels):
         raise ValueError("length of examples and labels do not match")
 
@@ -164,55 +145,38 @@ def chunk_examples(examples, labels, start_index, end_index):
     if chunk_size < 1:
         raise ValueError("chrunk_size has value of " + str(chunk_size))
 
+    # windows of one WindowDataset: X and Y of the chunk share a single one-hot buffer
+    if win.shares_buffer(examples, labels):
+        return examples.dataset.chunk(examples.first_tick + start_index, min(end_index, len(examples)) - start_index,
+                                      dtype)
+
     example_chunk = examples[start_index:end_index]
     label_fold = labels[start_index:end_index]
 
-    label_dataset= np.asarray(label_fold, dtype=np.float32)
-    example_dataset = np.asarray(example_chunk, dtype=np.float32)
+    # sparse labels (no one-hot axis next to one-hot examples) stay integers, shaped (samples, time_steps, 1) for
+    # sparse_categorical_crossentropy
+    if win.is_sparse(label_fold, np.shape(example_chunk)):
+        label_dataset = np.asarray(label_fold).astype(np.int32)
+        if label_dataset.ndim < len(np.shape(example_chunk)):
+            label_dataset = label_dataset[..., np.newaxis]
+    else:
+        label_dataset= np.asarray(label_fold, dtype=dtype)
+    example_dataset = np.asarray(example_chunk, dtype=dtype)
 
     return (example_dataset, label_dataset)
 
 
-def generate_folds(folds, data_pair):
-    example_list = data_pair[0]
-    label_list = data_pair[1]
-
-    if len(example_list) != len(label_list):
-        raise ValueError("expected example and label to have same number of samples")
-
-    fold_size = math.floor(len(example_list)/folds)
-
-    result = []
-    for i in range(folds):
-        fold = chunk_examples(example_list, label_list, i*fold_size, (i+1)*fold_size)
-        result.append(fold)
-
-    return result
+# folds disjoint (examples, labels) splits, materialized when used (see taskrecon_fold.Split)
+def generate_folds(folds, data_pair, dtype=np.float32):
+    return fold.disjoint_splits(folds, data_pair, dtype)
 
 '''
     This is the correct way
+    fold i trains on partitions [0, i] and tests on partition i + 1. the folds only hold index ranges into data_pair,
+    so their training prefixes are not copied once per fold (see taskrecon_fold)
 '''
-def generate_time_series_folds(folds, data_pair, batch_size=1):
-    example_list = data_pair[0]
-    label_list = data_pair[1]
-    partition = folds + 1
-    if len(example_list) != len(label_list):
-        raise ValueError("expected example and label to have same number of samples")
-
-    partition_size = math.floor(len(example_list) / partition)
-    while partition_size % batch_size != 0:
-        partition_size -= 1
-
-    ''' list of lists. each element of result is a list of partition where the last parition is the testing set'''
-    result = []
-
-    for i in range(folds):
-        fold = []
-        fold.append(chunk_examples(example_list, label_list, 0, (i+1)*partition_size))
-        fold.append(chunk_examples(example_list, label_list, (i + 1) * partition_size , (i + 2) * partition_size))
-        result.append(fold)
-
-    return result
+def generate_time_series_folds(folds, data_pair, batch_size=1, dtype=np.float32):
+    return fold.time_series_folds(folds, data_pair, batch_size, dtype)
 
 def index_of_label(vec):
     for i in range(len(vec)):
@@ -239,14 +203,7 @@ def validate_dataset(example_dataset, label_dataset, offset=0):
     return 0
 
 def mySim_to_list(fileName):
-    trace = []
-    data_file = open(fileName, 'r')
-    raw_trace = data_file.readlines()[0].split(',')
-
-
-    for i in range(len(raw_trace)):
-        trace.append(int(raw_trace[i]))
-    return trace
+    return tio.load_cached(fileName, tio.parse_comma_trace)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import numpy as np
+from keras.utils import Sequence
+from keras.callbacks import Callback
+import taskrecon_window as win
+import taskrecon_fold as fold
+
+'''
+    Keras feed for the overlapped windows of taskrecon_converter.list_to_example_overlap.
+
+    Only integer task ids are kept (the int8 window views of taskrecon_window); each batch is one-hot encoded when
+    keras asks for it. Batches are served in order and the length is cut to a multiple of batch_size, the same
+    alignment generate_single_fold / generate_time_series_folds enforce for the stateful models.
+    Use it with shuffle=False (fit_generator shuffles batch order otherwise).
+
+    index_inputs=True serves the inputs as int32 task ids of shape (batch, time_steps) for models with an Embedding
+    front end (create_model(embedding_dim=...)), only the labels are one-hot encoded.
+    sparse_labels=True serves the labels as int32 task ids of shape (batch, time_steps, 1) for
+    loss="sparse_categorical_crossentropy".
+'''
+class OneHotSequence(Sequence):
+
+    def __init__(self, examples, labels, batch_size, start=0, stop=None, dtype=np.float32, label_card=None,
+                 index_inputs=False, sparse_labels=False):
+        if len(examples) != len(labels):
+            raise ValueError("expected example and label to have same number of samples")
+        if stop is None:
+            stop = len(examples)
+        if stop - start < batch_size:
+            raise ValueError("feed range " + str((start, stop)) + " is shorter than one batch of " + str(batch_size))
+
+        self.examples = examples.indices if isinstance(examples, win.OneHotView) else np.asarray(examples)
+        self.labels = labels.indices if isinstance(labels, win.OneHotView) else np.asarray(labels)
+        if label_card is None:
+            for view in (examples, labels):
+                if isinstance(view, win.OneHotView):
+                    label_card = view.label_card
+        if label_card is None:
+            label_card = int(max(self.examples.max(), self.labels.max())) + 1
+        self.label_card = label_card
+        self.index_inputs = index_inputs
+        self.sparse_labels = sparse_labels
+        self.batch_size = batch_size
+        self.start = start
+        self.stop = stop - (stop - start) % batch_size
+        self.dtype = dtype
+
+    def __len__(self):
+        return (self.stop - self.start) // self.batch_size
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError("batch index out of range")
+        low = self.start + index * self.batch_size
+        high = low + self.batch_size
+        if self.index_inputs:
+            x = self.examples[low:high].astype(np.int32)
+        else:
+            x = win.one_hot(self.examples[low:high], self.label_card, self.dtype)
+        if self.sparse_labels:
+            y = self.labels[low:high].astype(np.int32)[..., np.newaxis]
+        else:
+            y = win.one_hot(self.labels[low:high], self.label_card, self.dtype)
+        return x, y
+
+    def sample_count(self):
+        return self.stop - self.start
+
+    # integer labels of every sample in the feed, shape (samples, time_steps)
+    def label_indices(self):
+        return np.asarray(self.labels[self.start:self.stop])
+
+
+'''
+    Feed for the stateful stream layout (taskrecon_window.StreamDataset): batch k holds window k of batch_size
+    contiguous streams, so a stateful model sees every tick once per epoch instead of time_steps times.
+    Train it with fit_generator(..., shuffle=False, callbacks=[ResetStates()]) so the state follows the streams within
+    an epoch and is only reset between epochs.
+'''
+class StreamSequence(Sequence):
+
+    def __init__(self, dataset, dtype=np.float32, index_inputs=False, sparse_labels=False):
+        if len(dataset) == 0:
+            raise ValueError("trace of " + str(len(dataset.ticks)) + " ticks is too short for one batch of "
+                             + str(dataset.batch_size) + " streams of " + str(dataset.time_steps) + " steps")
+        self.dataset = dataset
+        self.label_card = dataset.label_card
+        self.batch_size = dataset.batch_size
+        self.dtype = dtype
+        self.index_inputs = index_inputs
+        self.sparse_labels = sparse_labels
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        examples, labels = self.dataset.batch(index)
+        if self.index_inputs:
+            x = examples.astype(np.int32)
+        else:
+            x = win.one_hot(examples, self.label_card, self.dtype)
+        if self.sparse_labels:
+            y = labels.astype(np.int32)[..., np.newaxis]
+        else:
+            y = win.one_hot(labels, self.label_card, self.dtype)
+        return x, y
+
+    def sample_count(self):
+        return len(self) * self.batch_size
+
+    # integer labels in the order predict_generator returns the batches, shape (samples, time_steps)
+    def label_indices(self):
+        return self.dataset.label_indices()
+
+
+# resets a stateful model between epochs, the streams carry the state within one
+class ResetStates(Callback):
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.model.reset_states()
+
+
+'''
+    Stream layout over the same partition as single_fold_feeds, on ticks instead of windows: the first fold_count
+    partitions of the trace train, the next one tests. Both feeds use batch_size streams (the batch size of the
+    stateful model), so every partition needs at least batch_size * time_steps + offset + 1 ticks
+    (see max_stream_count).
+'''
+def max_stream_count(tick_count, fold_count, time_steps=100, offset=0):
+    return max(fold.partition_size(tick_count, fold_count + 1) - offset - 1, 0) // time_steps
+
+
+def stream_fold_feeds(fold_count, trace, batch_size, time_steps=100, offset=0, dtype=np.float32,
+                      index_inputs=False, sparse_labels=False, label_card=None):
+    ticks = win.as_ticks(trace)
+    if label_card is None:
+        label_card = len(np.unique(ticks))
+    size = fold.partition_size(len(ticks), fold_count + 1)
+    if batch_size > max_stream_count(len(ticks), fold_count, time_steps, offset):
+        raise ValueError("a stream layout of " + str(batch_size) + " streams of " + str(time_steps)
+                         + " steps needs " + str(batch_size * time_steps + offset + 1) + " ticks per partition, the "
+                         + str(len(ticks)) + " ticks split into " + str(fold_count + 1) + " partitions of "
+                         + str(size) + " fit at most " + str(max_stream_count(len(ticks), fold_count, time_steps, offset))
+                         + " streams")
+
+    train = win.StreamDataset(ticks[:fold_count * size], batch_size, time_steps, offset, label_card)
+    test = win.StreamDataset(ticks[fold_count * size:(fold_count + 1) * size], batch_size, time_steps, offset,
+                             label_card)
+    return (StreamSequence(train, dtype, index_inputs, sparse_labels),
+            StreamSequence(test, dtype, index_inputs, sparse_labels))
+
+
+# feed over the index range of a taskrecon_fold.Split
+def split_feed(split, batch_size, dtype=np.float32, index_inputs=False, sparse_labels=False, label_card=None):
+    return OneHotSequence(split.data_pair[0], split.data_pair[1], batch_size, split.start, split.stop,
+                          dtype, label_card, index_inputs, sparse_labels)
+
+
+'''
+    Same partition as app.generate_single_fold: the first fold_count partitions train, the next one tests.
+'''
+def single_fold_feeds(fold_count, data_pair, batch_size=1, dtype=np.float32, index_inputs=False,
+                      sparse_labels=False, label_card=None):
+    train, test = fold.single_fold(fold_count, data_pair, batch_size)
+    return (split_feed(train, batch_size, dtype, index_inputs, sparse_labels, label_card),
+            split_feed(test, batch_size, dtype, index_inputs, sparse_labels, label_card))
+
+
+'''
+    Same partition as taskrecon_converter.generate_time_series_folds: fold i trains on partitions [0, i] and tests
+    on partition i + 1.
+'''
+def time_series_fold_feeds(folds, data_pair, batch_size=1, dtype=np.float32, index_inputs=False,
+                           sparse_labels=False, label_card=None):
+    return [[split_feed(split, batch_size, dtype, index_inputs, sparse_labels, label_card) for split in pair]
+            for pair in fold.time_series_folds(folds, data_pair, batch_size)]
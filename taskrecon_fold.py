@@ -0,0 +1,102 @@
+import math
+import numpy as np
+import taskrecon_converter as cvt
+
+'''
+    Folds as index ranges over one backing (examples, labels) pair.
+
+    Copying every fold up front (chunk_examples per fold) makes walk-forward validation cost the sum of all
+    training prefixes [0, (i + 1) * partition_size), i.e. memory quadratic in the fold count. A Split only keeps
+    (start, stop) and materializes its samples through chunk_examples when they are asked for, so the folds cost
+    nothing until one of them is used and only that one is ever held by the caller.
+
+    A Split reads like the (x, y) pair the fold builders used to return (split[0], split[1], x, y = split) and a Fold
+    like the [train, test] list (fold[0], fold[1], train, test = fold). Unpacking materializes x and y together,
+    which keeps the shared one-hot buffer of overlapped windows (taskrecon_window.WindowDataset.chunk).
+    chunk is the chunk_examples(examples, labels, start, stop, dtype) that materializes the samples, the classification
+    one of taskrecon_converter by default (regression_model/converter passes its own).
+'''
+class Split:
+
+    def __init__(self, data_pair, start, stop, dtype=np.float32, chunk=None):
+        if len(data_pair[0]) != len(data_pair[1]):
+            raise ValueError("expected example and label to have same number of samples")
+        if stop - start < 1:
+            raise ValueError("split range " + str((start, stop)) + " is empty")
+        self.data_pair = data_pair
+        self.start = start
+        self.stop = stop
+        self.dtype = dtype
+        self.chunk = cvt.chunk_examples if chunk is None else chunk
+
+    def __repr__(self):
+        return "Split(" + str(self.start) + ", " + str(self.stop) + ")"
+
+    def sample_count(self):
+        return self.stop - self.start
+
+    # (x, y) of the whole range as arrays of dtype
+    def materialize(self):
+        return self.chunk(self.data_pair[0], self.data_pair[1], self.start, self.stop, self.dtype)
+
+    # (x, y) batch_size samples at a time, the last batch may be shorter
+    def batches(self, batch_size):
+        for low in range(self.start, self.stop, batch_size):
+            yield self.chunk(self.data_pair[0], self.data_pair[1], low, min(low + batch_size, self.stop), self.dtype)
+
+    def __getitem__(self, key):
+        if key not in (0, 1, -1, -2):
+            raise IndexError("a split only holds examples (0) and labels (1)")
+        return self.materialize()[key]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+
+class Fold:
+
+    def __init__(self, train, test):
+        self.train = train
+        self.test = test
+
+    def __repr__(self):
+        return "Fold(train=" + repr(self.train) + ", test=" + repr(self.test) + ")"
+
+    def __getitem__(self, key):
+        return (self.train, self.test)[key]
+
+    def __iter__(self):
+        return iter((self.train, self.test))
+
+
+# largest partition of sample_count / partition samples that is a multiple of batch_size
+def partition_size(sample_count, partition, batch_size=1):
+    size = math.floor(sample_count / partition)
+    return size - size % batch_size
+
+
+# fold i trains on partitions [0, i] and tests on partition i + 1
+def time_series_folds(folds, data_pair, batch_size=1, dtype=np.float32):
+    size = partition_size(len(data_pair[0]), folds + 1, batch_size)
+    return [Fold(Split(data_pair, 0, (i + 1) * size, dtype), Split(data_pair, (i + 1) * size, (i + 2) * size, dtype))
+            for i in range(folds)]
+
+
+# the first fold_count partitions train, the next one tests
+def single_fold(fold_count, data_pair, batch_size=1, dtype=np.float32):
+    size = partition_size(len(data_pair[0]), fold_count + 1, batch_size)
+    return Fold(Split(data_pair, 0, fold_count * size, dtype),
+                Split(data_pair, fold_count * size, (fold_count + 1) * size, dtype))
+
+
+# folds disjoint splits of equal size
+def disjoint_splits(folds, data_pair, dtype=np.float32):
+    size = partition_size(len(data_pair[0]), folds)
+    return [Split(data_pair, i * size, (i + 1) * size, dtype) for i in range(folds)]
+
+
+# train is [0, ratio * n), test is [ratio * n + 1, n - 1), the split split_train_test has always made
+def ratio_fold(ratio, data_pair, dtype=np.float32, chunk=None):
+    train_max_ind = int(len(data_pair[0]) * ratio)
+    return Fold(Split(data_pair, 0, train_max_ind, dtype, chunk),
+                Split(data_pair, train_max_ind + 1, len(data_pair[0]) - 1, dtype, chunk))
@@ -3,11 +3,14 @@ from keras.models import Sequential
 from keras.layers import Dense
 from keras.layers import Dropout
 from keras.layers import LSTM
+from keras.layers import Embedding
 import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.metrics import confusion_matrix
 import taskrecon_converter as cvt
+import taskrecon_window as win
 from keras.models import load_model
+from keras.utils import Sequence
 import matplotlib.pyplot as plt
 
 import time
@@ -19,7 +22,7 @@ def score_display(fold_scores):
     for i in range(fold_count):
         print("fold " + str(i) + ":", end="")
         fold_avg = []
-        for j in range(fold_count-1):
+        for j in range(len(fold_scores[i])):
             fold_avg.append(fold_scores[i][j][1])
             print("\t"+str(fold_scores[i][j][1]), end="")
         avg.append(np.mean(fold_avg))
@@ -30,13 +33,27 @@ def score_display(fold_scores):
 
 
 
-def create_model(cell_count, shape, stateful, batch, output_dim, loss="poisson", drop_out = False):
+'''
+    shape = (time_steps, label_card)
+    embedding_dim: None takes one-hot inputs of that shape. Otherwise the model takes int task ids of shape
+    (time_steps,) and embeds them into embedding_dim before the LSTM
+    loss="sparse_categorical_crossentropy" trains on integer targets of shape (time_steps, 1) instead of one-hot
+'''
+def create_model(cell_count, shape, stateful, batch, output_dim, loss="poisson", drop_out = False, embedding_dim=None):
     model = Sequential()
-    model.add(LSTM(cell_count,
-              input_shape=shape,
-			  batch_size=batch,
-              stateful=stateful,
-			  return_sequences=True))
+    if embedding_dim is not None:
+        model.add(Embedding(shape[1], embedding_dim,
+                            input_length=shape[0],
+                            batch_size=batch))
+        model.add(LSTM(cell_count,
+                  stateful=stateful,
+                  return_sequences=True))
+    else:
+        model.add(LSTM(cell_count,
+                  input_shape=shape,
+                  batch_size=batch,
+                  stateful=stateful,
+                  return_sequences=True))
     model.add(Dense(cell_count, activation='relu'))
     if drop_out:
         model.add(Dropout(0.3))
@@ -64,8 +81,8 @@ def run(filename, fold_count, time_step, label_card, gap, batchSize):
 
     for i in range(fold_count):
         model = create_model(100, (time_step, label_card), True, batch=batchSize, output_dim=label_card, loss="categorical_crossentropy")
-        train = folds[i]
-        fit_history = model.fit(train[0], train[1], epochs=1, batch_size=batchSize, verbose=1)
+        x_train, y_train = folds[i]
+        fit_history = model.fit(x_train, y_train, epochs=1, batch_size=batchSize, verbose=1)
         model.save("model/foldIndex_" + str(i) + ".model")
         score_list = []
         true_score_list = []
@@ -74,8 +91,9 @@ def run(filename, fold_count, time_step, label_card, gap, batchSize):
                 continue
             model.reset_states()
             # manually call predict
-            scores = model.evaluate(folds[j][0], folds[j][1], batch_size=batchSize, verbose=1)
-            confusion, trueAcc = manual_verification_100(model, folds[j], batch_size=batchSize)
+            x_test, y_test = folds[j]
+            scores = model.evaluate(x_test, y_test, batch_size=batchSize, verbose=1)
+            confusion, trueAcc = manual_verification_100(model, (x_test, y_test), batch_size=batchSize)
 
             save_matrix(confusion, "train_"+str(i)+"_test_"+str(j)+".confusion")
 
@@ -87,11 +105,25 @@ def run(filename, fold_count, time_step, label_card, gap, batchSize):
     score_display(fold_scores)
     score_display(true_fold_scores)
 
-def manual_verification(model, test_dataset, batch_size=1):
+'''
+    predictions and integer labels for a test set given either as an (x, y) pair (or a taskrecon_fold.Split), with y
+    one-hot or sparse integer labels, or as a taskrecon_feed.OneHotSequence, which is predicted batch by batch
+'''
+def predict_labels(model, test_dataset, batch_size=1):
     model.reset_states()
-    y = model.predict(test_dataset[0], batch_size=batch_size)
+    if isinstance(test_dataset, Sequence):
+        return model.predict_generator(test_dataset), test_dataset.label_indices()
+    x, labels = test_dataset
+    y = model.predict(x, batch_size=batch_size)
+    labels = np.asarray(labels)
+    if win.is_sparse(labels, y.shape):
+        return y, np.reshape(labels, y.shape[:-1])
+    return y, np.argmax(labels, axis=-1)
+
+def manual_verification(model, test_dataset, batch_size=1):
+    y, labels = predict_labels(model, test_dataset, batch_size)
     print(np.argmax(y,axis=2))
-    confusion = confusion_matrix(np.argmax(test_dataset[1],axis=2), np.argmax(y,axis=2), labels=range(16))
+    confusion = confusion_matrix(labels, np.argmax(y,axis=2), labels=range(16))
     print(confusion)
     correct = 0
     for i in range(16):
@@ -102,8 +134,7 @@ def manual_verification(model, test_dataset, batch_size=1):
     return (confusion, float(correct / len(y)))
 
 def manual_verification_100(model, test_dataset, batch_size=1):
-    model.reset_states()
-    y = model.predict(test_dataset[0], batch_size=batch_size)
+    y, labels = predict_labels(model, test_dataset, batch_size)
     # otuput shape will be the same as the input shape
 
     label_card = len(y[1][0])
@@ -112,7 +143,7 @@ def manual_verification_100(model, test_dataset, batch_size=1):
     for i in range(len(y)):
         pred_y = np.argmax(y[i][-1])
         true_pred_y.append(pred_y)
-        label = np.argmax(test_dataset[1][i][-1])
+        label = labels[i][-1]
         true_y.append(label)
 
     confusion = confusion_matrix(true_y, true_pred_y , labels=range(label_card))
@@ -126,8 +157,7 @@ def manual_verification_100(model, test_dataset, batch_size=1):
     return (confusion, float(correct / len(y)))
 
 def manual_verification_disjoint(model, test_dataset, batch_size=1):
-    model.reset_states()
-    y = model.predict(test_dataset[0], batch_size=batch_size)
+    y, labels = predict_labels(model, test_dataset, batch_size)
     # otuput shape will be the same as the input shape
     time_step = len(y[1])
     print("time_step" + str(time_step))
@@ -137,7 +167,7 @@ def manual_verification_disjoint(model, test_dataset, batch_size=1):
         for j in range(time_step):
             pred_y = np.argmax(y[i][j])
             true_pred_y.append(pred_y)
-            label = np.argmax(test_dataset[1][i][j])
+            label = labels[i][j]
             true_y.append(label)
 
     confusion = confusion_matrix(true_y, true_pred_y , labels=range(16))
@@ -8,8 +8,8 @@ import  keras.models as km
 
 
 from keras.utils import plot_model
-from os import listdir
-from os.path import isfile, join
+from taskrecon_trace import Trace
+import taskrecon_io as tio
 
 '''
     This python script creates a model to infer number of tasks from busy intervals.
@@ -82,6 +82,16 @@ class Converter:
             vect.append((0, int_interval_duration))
         return vect
 
+    # returns the rest/busy runs of a run-length taskrecon_trace.Trace of task ids as [(state, duration), ...]
+    # state 0 = rest (task 0), 1 = busy (any other task), neighbouring busy runs of different tasks are merged.
+    # every run is kept, from the first tick on, without expanding the trace to ticks. unlike vectorize the input is
+    # a trace of task ids, not a list of signed interval durations
+    @staticmethod
+    def busy_runs(trace):
+        busy = Trace((trace.tasks > 0).astype(np.uint8), trace.durations)
+        return list(zip(busy.tasks.tolist(), busy.durations.tolist()))
+
+    # takes a list of signed interval durations (< 0 rest, > 0 busy), the first element is skipped
     @staticmethod
     def vectorize(string_trace):
         # convert trace to intervals
@@ -128,41 +138,41 @@ class Converter:
             vec_o_tup_output.append((vec_i, int_group_label))
         return vec_o_tup_output
 
-    def partition_train_test(data_dict, ratio):
-        train_x = []
-        train_y = []
-        test_x = []
-        test_y = []
-        remapped_x = []
-        remapped_y = []
-
+    # stratified split of labels[i] as index arrays: floor(n * ratio) of the n items of every label train, the rest
+    # test. both index arrays come back shuffled. seed makes the split reproducible, None draws from np.random
+    @staticmethod
+    def partition_indices(labels, ratio, seed=None):
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        labels = np.asarray(labels)
+        if len(labels) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        # random order within every label, labels grouped together
+        order = rng.permutation(len(labels))
+        order = order[np.argsort(labels[order], kind="stable")]
+        grouped = labels[order]
+        starts = np.flatnonzero(np.concatenate(([True], grouped[1:] != grouped[:-1])))
+        counts = np.diff(np.append(starts, len(labels)))
+
+        rank = np.arange(len(labels)) - np.repeat(starts, counts)
+        is_train = rank < np.repeat(np.floor(counts * ratio), counts)
+        return rng.permutation(order[is_train]), rng.permutation(order[~is_train])
+
+    # data_dict maps a label to its list of samples. samples are returned as lists, labels as arrays
+    @staticmethod
+    def partition_train_test(data_dict, ratio, seed=None):
+        samples = []
+        labels = []
         for label, vec_data in data_dict.items():
-            data_len = len(vec_data)
-            index_list = np.random.permutation(data_len)
-            for i in range(math.floor(data_len * ratio)):
-                train_x.append(vec_data[index_list[i]])
-                train_y.append(label)
-            for i in range(math.floor(data_len * ratio), data_len):
-                test_x.append(vec_data[index_list[i]])
-                test_y.append(label)
-
-        index_list = np.random.permutation(len(train_x))
-        for i in range(len(train_x)):
-            remapped_x.append(train_x[index_list[i]])
-            remapped_y.append(train_y[index_list[i]])
-        train_x = remapped_x
-        train_y = remapped_y
+            samples += list(vec_data)
+            labels += [label] * len(vec_data)
+        labels = np.asarray(labels)
 
-        remapped_x = []
-        remapped_y = []
-        index_list = np.random.permutation(len(test_x))
-        for i in range(len(test_x)):
-            remapped_x.append(test_x[index_list[i]])
-            remapped_y.append(test_y[index_list[i]])
-        test_x = remapped_x
-        test_y = remapped_y
+        train_index, test_index = Converter.partition_indices(labels, ratio, seed)
+        train_x = [samples[i] for i in train_index]
+        test_x = [samples[i] for i in test_index]
 
-        return train_x, train_y, test_x, test_y
+        return train_x, labels[train_index], test_x, labels[test_index]
 
 
 
@@ -194,11 +204,11 @@ class ModelReg:
         int_train_len = math.floor(int_total_len * float_train_ratio)
         int_test_len = int_total_len - int_train_len
 
-        vec_o_tup_train = vec_o_tup_x[:int_train_len]
-        vec_o_tup_test = vec_o_tup_x[-1 * int_test_len:]
+        # converted once, train and test are views of the same matrices
+        mat_x, mat_y = ModelReg.vec_o_tup_to_mat_reg(vec_o_tup_x)
 
-        mat_train_x, mat_train_y = Converter.vec_o_tup_to_mat_reg(vec_o_tup_train)
-        mat_test_x, mat_test_y = Converter.vec_o_tup_to_mat_reg(vec_o_tup_test)
+        mat_train_x, mat_train_y = mat_x[:int_train_len], mat_y[:int_train_len]
+        mat_test_x, mat_test_y = mat_x[-1 * int_test_len:], mat_y[-1 * int_test_len:]
 
         return mat_train_x, mat_train_y, mat_test_x, mat_test_y
         # returns datapoint and its label (each data point is a list of vectorize() output from different dataset)
@@ -292,11 +302,11 @@ class ModelOhv:
         int_train_len = math.floor(int_total_len * float_train_ratio)
         int_test_len = int_total_len - int_train_len
 
-        vec_o_tup_train = vec_o_tup_x[:int_train_len]
-        vec_o_tup_test = vec_o_tup_x[-1 * int_test_len:]
+        # converted once, train and test are views of the same matrices
+        mat_x, mat_y = ModelOhv.vec_o_tup_to_mat_ohv(vec_o_tup_x)
 
-        mat_train_x, mat_train_y = Converter.vec_o_tup_to_mat_ohv(vec_o_tup_train)
-        mat_test_x, mat_test_y = Converter.vec_o_tup_to_mat_ohv(vec_o_tup_test)
+        mat_train_x, mat_train_y = mat_x[:int_train_len], mat_y[:int_train_len]
+        mat_test_x, mat_test_y = mat_x[-1 * int_test_len:], mat_y[-1 * int_test_len:]
 
         return mat_train_x, mat_train_y, mat_test_x, mat_test_y
 
@@ -355,22 +365,13 @@ if __name__ == "__main__":
     # model.fit(train_x[0], train_x[1])
 
     stop = 0
-    onlyfiles = [f for f in listdir("./data/") if isfile(join("./data/", f))]
 
     data_dict = {}
 
-    for filename in onlyfiles:
-        label = int(filename.split("rep")[0].split("size")[1])
-        rep_count = int(filename.split("rep")[1].split(".")[0])
-
+    for (label, rep_count), parsed_trace in sorted(tio.load_directory("./data/", pattern="*").items()):
         if label not in data_dict:
             data_dict[label] = []
-
-        with open("./data/" + filename) as file:
-            data = file.read()
-            parsed_trace = [int(x) for x in data.split(", ")]
-            data_dict[label].append(parsed_trace)
-            file.close()
+        data_dict[label].append(parsed_trace)
 
 
     train_x, train_y, test_x, test_y = Converter.partition_train_test(data_dict, 0.75)
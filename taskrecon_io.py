@@ -0,0 +1,429 @@
+import os
+import re
+import glob
+import json
+import lzma
+import zlib
+import numpy as np
+from multiprocessing import Pool
+from taskrecon_organizer import DirectoryOrganizer
+
+'''
+    Trace file loading shared by taskrecon_converter and regression_model/converter.
+
+    Parsed traces are cached in a binary sidecar next to the source file:
+        data/size15rep0.data
+        data/size15rep0.data.npy        compact integer array (np.load with mmap_mode)
+        data/size15rep0.data.npy.json   size and mtime of the source the array was built from
+    The sidecar is rebuilt whenever the source size or mtime no longer match. While it is written the directory also
+    holds its lock (.npy.lock, taskrecon_store.trace_lock) and temporary files (.tmp<pid>), see data_files.
+'''
+CACHE_SUFFIX = ".npy"
+CACHE_KEY_SUFFIX = ".json"
+MANIFEST_SUFFIX = ".manifest.json"
+LOCK_SUFFIX = ".lock"
+TEMP_SUFFIX = re.compile(r"\.tmp\d*$")
+READ_BLOCK_SIZE = 1 << 20
+
+
+def cache_name(fileName):
+    return fileName + CACHE_SUFFIX
+
+
+def source_key(fileName):
+    stat = os.stat(fileName)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+# smallest integer dtype holding every task id of the trace
+def compact_dtype(low, high):
+    for dtype in (np.uint8, np.uint16, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def compact_array(trace):
+    trace = np.asarray(trace)
+    if trace.size == 0:
+        return trace.astype(np.uint8)
+    return trace.astype(compact_dtype(int(trace.min()), int(trace.max())), copy=False)
+
+
+def read_cache(fileName):
+    array_name = cache_name(fileName)
+    key_name = array_name + CACHE_KEY_SUFFIX
+    if not (os.path.isfile(array_name) and os.path.isfile(key_name)):
+        return None
+
+    try:
+        with open(key_name, "r") as file:
+            key = json.load(file)
+    except ValueError:
+        return None
+    if key != source_key(fileName):
+        return None
+
+    return np.load(array_name, mmap_mode='r')
+
+
+# the key file is written last so that an interrupted write never looks valid.
+# temporary names carry the pid so that processes filling the same cache do not clobber each other
+def write_cache(fileName, trace):
+    trace = compact_array(trace)
+    array_name = cache_name(fileName)
+    key_name = array_name + CACHE_KEY_SUFFIX
+    key = source_key(fileName)
+    tmp_suffix = ".tmp" + str(os.getpid())
+
+    try:
+        if os.path.exists(key_name):
+            os.remove(key_name)
+        with open(array_name + tmp_suffix, "wb") as file:
+            np.save(file, trace)
+        os.replace(array_name + tmp_suffix, array_name)
+        with open(key_name + tmp_suffix, "w") as file:
+            file.write(json.dumps(key))
+        os.replace(key_name + tmp_suffix, key_name)
+    except OSError:
+        # read-only data directory: still hand back the parsed trace
+        print("could not write trace cache for " + fileName)
+
+    return trace
+
+
+'''
+    parser is called with fileName on a cache miss and must return a sequence of ints.
+'''
+def load_cached(fileName, parser):
+    trace = read_cache(fileName)
+    if trace is not None:
+        return trace
+    return write_cache(fileName, parser(fileName))
+
+
+# "0, 4, 15, 4, 0" or "0,4,15,4,0" on a single line
+def parse_comma_trace(fileName):
+    return read_comma_range(fileName)
+
+
+'''
+    returns trace[start:stop], from the sidecar when it is valid (or decoded when fileName is a .trz). Otherwise a full read is parsed and cached
+    while a bounded read is streamed so only the requested range is ever held in memory.
+'''
+def load_comma_trace(fileName, start=0, stop=None):
+    if detect_format(fileName) == FORMAT_COMPRESSED:
+        return read_compressed_trace(fileName)[start:stop]
+    trace = read_cache(fileName)
+    if trace is not None:
+        return trace[start:stop]
+    if stop is None:
+        return write_cache(fileName, parse_comma_trace(fileName))[start:]
+    return read_comma_range(fileName, start, stop)
+
+
+'''
+    Reads the first line of fileName in blocks of block_size bytes and yields the text of each block cut at the
+    last separator, so that every yielded chunk holds whole values. The remainder is carried into the next block.
+'''
+def iter_comma_chunks(fileName, block_size=READ_BLOCK_SIZE):
+    carry = b""
+    with open(fileName, "rb") as data_file:
+        while True:
+            block = data_file.read(block_size)
+            end_of_line = block.find(b"\n")
+            if end_of_line >= 0:
+                block = block[:end_of_line]
+            last = len(block) == 0 or end_of_line >= 0
+            block = carry + block
+
+            if last:
+                if block.strip():
+                    yield block
+                return
+
+            cut = block.rfind(b",")
+            if cut < 0:
+                carry = block
+                continue
+            carry = block[cut + 1:]
+            yield block[:cut]
+
+
+def parse_comma_block(chunk, count=None):
+    if count is None:
+        count = chunk.count(b",") + 1
+    values = np.fromstring(chunk, dtype=np.int64, sep=",")
+    if len(values) != count:
+        raise ValueError("malformed trace block: expected " + str(count) + " values, parsed " + str(len(values)))
+    return values
+
+
+# yields the trace as int64 arrays, one per block
+def iter_comma_trace(fileName, block_size=READ_BLOCK_SIZE):
+    for chunk in iter_comma_chunks(fileName, block_size):
+        yield parse_comma_block(chunk)
+
+
+'''
+    Streams trace[start:stop] out of a comma separated file.
+    Blocks before start are only counted, never parsed, and reading stops once stop is reached.
+'''
+def read_comma_range(fileName, start=0, stop=None, block_size=READ_BLOCK_SIZE):
+    if start < 0 or (stop is not None and stop < start):
+        raise ValueError("expected 0 <= start <= stop, got start=" + str(start) + " stop=" + str(stop))
+
+    blocks = []
+    position = 0
+    for chunk in iter_comma_chunks(fileName, block_size):
+        if stop is not None and position >= stop:
+            break
+        count = chunk.count(b",") + 1
+        if position + count <= start:
+            position += count
+            continue
+
+        values = parse_comma_block(chunk, count)
+        low = max(start - position, 0)
+        high = count if stop is None else min(stop - position, count)
+        blocks.append(compact_array(values[low:high]))
+        position += count
+
+    if not blocks:
+        return compact_array([])
+    return compact_array(np.concatenate(blocks))
+
+
+'''
+    Interval format: "start-end,task,<ignored>," repeated on a single line, read by fields in groups of three
+    exactly like the old per-tick text_to_list loop. A trailing range without a task is dropped.
+    expand=True returns the per-tick trace built with np.repeat.
+    expand=False skips the expansion and returns the run-length form (tasks, durations).
+'''
+def parse_interval_trace(fileName, expand=True):
+    with open(fileName, 'r') as data_file:
+        raw_trace = data_file.readlines()[0].split(',')
+
+    raw_tasks = raw_trace[1::3]
+    raw_ranges = raw_trace[0::3][:len(raw_tasks)]
+
+    tasks = np.fromstring(",".join(raw_tasks), dtype=np.int64, sep=",")
+    bounds = np.fromstring(",".join(raw_ranges).replace("-", ","), dtype=np.int64, sep=",")
+    if len(tasks) != len(raw_tasks) or len(bounds) != 2 * len(raw_ranges):
+        raise ValueError("malformed interval trace: " + fileName)
+
+    durations = np.maximum(bounds[1::2] - bounds[0::2], 0)
+    tasks = compact_array(tasks)
+    if not expand:
+        return tasks, durations
+    return np.repeat(tasks, durations)
+
+
+'''
+    Compressed trace format (size15rep0.data.trz). The trace is stored as runs of (task, duration), which are
+    tiny for the periodic schedules we generate, and the runs are compressed with a stdlib codec:
+        b"TRZ" + codec id byte, then the compressed stream of little endian (int32 task, uint32 duration) records
+    iter_compressed_trace decompresses incrementally and yields numpy blocks, so the file is never held whole.
+'''
+COMPRESSED_SUFFIX = ".trz"
+COMPRESSED_MAGIC = b"TRZ"
+RUN_RECORD = np.dtype([("task", "<i4"), ("duration", "<u4")])
+
+CODECS = {
+    "lzma": (b"x", lambda: lzma.LZMACompressor(), lambda: lzma.LZMADecompressor()),
+    "gzip": (b"g", lambda: zlib.compressobj(9, zlib.DEFLATED, 31), lambda: zlib.decompressobj(31)),
+    "zlib": (b"z", lambda: zlib.compressobj(9), lambda: zlib.decompressobj()),
+}
+
+
+def codec_by_id(codec_id):
+    for name, codec in CODECS.items():
+        if codec[0] == codec_id:
+            return codec
+    raise ValueError("unknown trace codec: " + str(codec_id))
+
+
+def runs_of_block(ticks):
+    ticks = np.asarray(ticks)
+    if len(ticks) == 0:
+        return np.zeros(0, dtype=RUN_RECORD)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ticks)) + 1))
+    runs = np.empty(len(starts), dtype=RUN_RECORD)
+    runs["task"] = ticks[starts]
+    runs["duration"] = np.diff(np.append(starts, len(ticks)))
+    return runs
+
+
+'''
+    blocks is an iterable of per-tick arrays (e.g. iter_comma_trace) or of (tasks, durations) pairs when
+    runs=True. Runs are not merged across block boundaries, the decoder does not need them to be.
+'''
+def write_compressed(fileName, blocks, codec="lzma", runs=False):
+    codec_id, make_compressor, _ = CODECS[codec]
+    compressor = make_compressor()
+    with open(fileName + ".tmp", "wb") as out_file:
+        out_file.write(COMPRESSED_MAGIC + codec_id)
+        for block in blocks:
+            if runs:
+                records = np.empty(len(block[0]), dtype=RUN_RECORD)
+                records["task"] = block[0]
+                records["duration"] = block[1]
+            else:
+                records = runs_of_block(block)
+            out_file.write(compressor.compress(records.tobytes()))
+        out_file.write(compressor.flush())
+    os.replace(fileName + ".tmp", fileName)
+    return fileName
+
+
+# converts a text trace of either format to fileName + ".trz" without loading it whole
+def compress_trace_file(fileName, codec="lzma"):
+    if detect_format(fileName) == FORMAT_INTERVAL:
+        return write_compressed(fileName + COMPRESSED_SUFFIX, [parse_interval_trace(fileName, expand=False)],
+                                codec, runs=True)
+    return write_compressed(fileName + COMPRESSED_SUFFIX, iter_comma_trace(fileName), codec)
+
+
+def compress_directory(directory="./data", pattern="*.data", codec="lzma"):
+    return [compress_trace_file(f, codec) for f in data_files(directory, pattern, compressed=False)]
+
+
+'''
+    Yields (tasks, durations) blocks, or the expanded per-tick blocks with expand=True.
+'''
+def iter_compressed_trace(fileName, expand=True, block_size=READ_BLOCK_SIZE):
+    carry = b""
+    with open(fileName, "rb") as data_file:
+        header = data_file.read(len(COMPRESSED_MAGIC) + 1)
+        if header[:len(COMPRESSED_MAGIC)] != COMPRESSED_MAGIC:
+            raise ValueError("not a compressed trace: " + fileName)
+        decompressor = codec_by_id(header[len(COMPRESSED_MAGIC):])[2]()
+
+        while True:
+            compressed = data_file.read(block_size)
+            payload = carry + (decompressor.decompress(compressed) if compressed else b"")
+            whole = len(payload) - len(payload) % RUN_RECORD.itemsize
+            carry = payload[whole:]
+
+            if whole > 0:
+                records = np.frombuffer(payload[:whole], dtype=RUN_RECORD)
+                tasks = compact_array(records["task"])
+                durations = records["duration"].astype(np.int64)
+                if expand:
+                    yield np.repeat(tasks, durations)
+                else:
+                    yield tasks, durations
+
+            if not compressed:
+                if carry:
+                    raise ValueError("truncated compressed trace: " + fileName)
+                return
+
+
+# whole trace as a per-tick array, or as (tasks, durations) runs with expand=False
+def read_compressed_trace(fileName, expand=True):
+    blocks = list(iter_compressed_trace(fileName, expand))
+    if expand:
+        if not blocks:
+            return compact_array([])
+        return compact_array(np.concatenate(blocks))
+    if not blocks:
+        return compact_array([]), np.zeros(0, dtype=np.int64)
+    tasks = compact_array(np.concatenate([b[0] for b in blocks]))
+    return tasks, np.concatenate([b[1] for b in blocks])
+
+
+'''
+    Format autodetection. Every trace file in ./data is a single line and the first field tells them apart:
+        "0-5,3,..."     interval triples (text_to_list)
+        "0, 4, 15, ..." / "0,4,15,..." / "-12, 30, ..."   comma separated values (newText_to_list, mySim_to_list,
+                        and the signed durations read by taskrecon_interval_to_count)
+'''
+FORMAT_INTERVAL = "interval"
+FORMAT_LIST = "list"
+FORMAT_COMPRESSED = "compressed"
+DETECT_BYTES = 64
+
+INTERVAL_FIELD = re.compile(br"^\s*\d+\s*-\s*\d+\s*(,|$)")
+LIST_FIELD = re.compile(br"^\s*-?\d+\s*(,|$)")
+
+
+def detect_format(fileName):
+    with open(fileName, "rb") as data_file:
+        head = data_file.read(DETECT_BYTES)
+    if head.startswith(COMPRESSED_MAGIC):
+        return FORMAT_COMPRESSED
+    if INTERVAL_FIELD.match(head):
+        return FORMAT_INTERVAL
+    if LIST_FIELD.match(head):
+        return FORMAT_LIST
+    raise ValueError("unknown trace format: " + fileName)
+
+
+def load_trace(fileName, expand=True):
+    trace_format = detect_format(fileName)
+    if trace_format == FORMAT_INTERVAL:
+        return parse_interval_trace(fileName, expand)
+    if trace_format == FORMAT_COMPRESSED:
+        return read_compressed_trace(fileName, expand)
+    return load_comma_trace(fileName)
+
+
+def is_cache_file(fileName):
+    return fileName.endswith(CACHE_SUFFIX) or fileName.endswith(CACHE_SUFFIX + CACHE_KEY_SUFFIX) \
+        or fileName.endswith(MANIFEST_SUFFIX)
+
+
+# caches, manifests, locks and the temporary files they are written through
+def is_sidecar_file(fileName):
+    return is_cache_file(fileName) or fileName.endswith(LOCK_SUFFIX) or TEMP_SUFFIX.search(fileName) is not None
+
+
+'''
+    sorted trace files of directory matching pattern, without sidecars. a .trz is only listed when its text source
+    is not (it holds the same trace), compressed=False leaves out every .trz.
+'''
+def data_files(directory="./data", pattern="*.data", compressed=True):
+    fileNames = [f for f in glob.glob(os.path.join(directory, pattern)) if os.path.isfile(f) and not is_sidecar_file(f)]
+    listed = set(fileNames)
+    return sorted(f for f in fileNames if not f.endswith(COMPRESSED_SUFFIX)
+                  or (compressed and f[:-len(COMPRESSED_SUFFIX)] not in listed))
+
+
+# pool workers hand back plain arrays, memmaps do not survive pickling
+def load_trace_worker(fileName):
+    trace = load_trace(fileName)
+    return fileName, np.asarray(trace)
+
+
+'''
+    Loads every sizeXrepY trace of a directory into a dict keyed by (tasksize, rep).
+    Files with a valid sidecar are mapped directly, the rest are parsed in a process pool (which also writes their
+    sidecars). processes=None uses every core.
+'''
+def load_directory(directory="./data", pattern="*.data", processes=None):
+    fileNames = data_files(directory, pattern)
+
+    traces = {}
+    to_parse = []
+    for fileName in fileNames:
+        if detect_format(fileName) == FORMAT_LIST:
+            trace = read_cache(fileName)
+            if trace is not None:
+                traces[fileName] = trace
+                continue
+        to_parse.append(fileName)
+
+    if len(to_parse) > 1 and processes != 1:
+        with Pool(processes) as workers:
+            for fileName, trace in workers.imap_unordered(load_trace_worker, to_parse):
+                traces[fileName] = trace
+    else:
+        for fileName in to_parse:
+            traces[fileName] = load_trace(fileName)
+
+    result = {}
+    for fileName in fileNames:
+        result[DirectoryOrganizer.parse_name(os.path.basename(fileName))] = traces[fileName]
+    return result
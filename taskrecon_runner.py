@@ -0,0 +1,138 @@
+import os
+import json
+import multiprocessing
+from contextlib import contextmanager
+import taskrecon_converter as cvt
+import taskrecon_store as store
+import taskrecon_fold as fold
+
+'''
+    Walk-forward cross-validation with the folds trained side by side on CPU.
+
+    Every fold of taskrecon_converter.generate_time_series_folds is independent (fold i trains on partitions [0, i]
+    and tests on partition i + 1), so each one gets its own worker process with its own model and session.
+    Workers are spawned rather than forked (a forked tensorflow runtime can deadlock) and each one is capped to
+    `threads` intra-op threads, so processes * threads stays within the cores instead of every session grabbing all
+    of them. The trace is not sent to the workers: the parent builds the binary sidecar once and every worker maps it
+    read-only (taskrecon_store.open_shared), so the ticks are shared through the page cache. Each worker only
+    one-hot encodes its own batches (taskrecon_feed).
+
+    The OpenMP / BLAS limits are read once, when numpy loads its BLAS, and a spawned worker imports numpy (through
+    this module) before its initializer runs. They are therefore set in the parent's environment while the pool
+    starts, which the workers inherit; keras and tensorflow are imported inside the workers by the initializer.
+'''
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+# the environment spawned workers start with, the parent's own environment is restored on exit
+@contextmanager
+def worker_environment(threads):
+    names = ("CUDA_VISIBLE_DEVICES",) + THREAD_VARIABLES
+    saved = {name: os.environ.get(name) for name in names}
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    for name in THREAD_VARIABLES:
+        os.environ[name] = str(threads)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+# pool initializer, caps the tensorflow session of the worker
+def limit_threads(threads, inter_threads=1):
+    import tensorflow as tf
+    if hasattr(tf, "ConfigProto"):
+        from keras import backend
+        config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                inter_op_parallelism_threads=inter_threads,
+                                device_count={"GPU": 0})
+        backend.set_session(tf.Session(config=config))
+    else:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+
+def fold_worker(job):
+    import taskrecon_guesser as gue
+    import taskrecon_feed as feed
+
+    (index, fileName, start, stop, fold_count, settings, directory) = job
+    label_card = store.trace_manifest(fileName)["label_range"]
+    trace = store.open_shared(fileName)[start:stop]
+
+    time_steps = settings["time_steps"]
+    batch_size = settings["batch_size"]
+    gap = settings["gap"]
+    dataset = cvt.list_to_example_overlap(trace, time_steps=time_steps, overlap_gap=gap, label_card=label_card)
+    train, test = fold.time_series_folds(fold_count, dataset, batch_size)[index]
+    train_feed = feed.split_feed(train, batch_size, label_card=label_card)
+    test_feed = feed.split_feed(test, batch_size, label_card=label_card)
+
+    model = gue.create_model(settings["node_size"], (time_steps, label_card), stateful=True, batch=batch_size,
+                             output_dim=label_card, loss=settings["loss"], drop_out=settings["drop_out"])
+    model.fit_generator(train_feed, epochs=settings["epochs"], verbose=0, shuffle=False)
+
+    if gap > 1:
+        (cnf_mat, acc) = gue.manual_verification_disjoint(model, test_feed, batch_size=batch_size)
+    else:
+        (cnf_mat, acc) = gue.manual_verification_100(model, test_feed, batch_size=batch_size)
+
+    if directory is not None:
+        model.save(os.path.join(directory, "fold" + str(index) + ".model"))
+        gue.save_matrix(cnf_mat, os.path.join(directory, "fold" + str(index) + ".confusion"))
+    return (index, cnf_mat, acc)
+
+
+def default_settings():
+    return {"node_size": 100, "batch_size": 1000, "epochs": 7, "time_steps": 100, "gap": 1,
+            "loss": "categorical_crossentropy", "drop_out": True}
+
+
+'''
+    trains and tests the fold_count walk-forward folds of trace[start:stop] in parallel.
+    settings: node_size, batch_size, epochs, time_steps, gap, loss, drop_out (the keys of default_settings).
+    processes defaults to one per fold (at most one per core), threads to an even share of the cores.
+    returns ([confusion matrix of every fold], [accuracy of every fold], average accuracy). with a directory, the
+    models, confusion matrices and a stat.json of the accuracies are written into it.
+'''
+def run_folds(fileName, fold_count, settings=None, start=0, stop=None, directory=None, processes=None,
+              threads=None):
+    import taskrecon_guesser as gue
+
+    job_settings = default_settings()
+    if settings is not None:
+        job_settings.update(settings)
+    if processes is None:
+        processes = min(fold_count, os.cpu_count() or 1)
+    if threads is None:
+        threads = max((os.cpu_count() or 1) // processes, 1)
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # built once here so the workers only map it
+    store.open_shared(fileName)
+    store.trace_manifest(fileName)
+
+    jobs = [(i, fileName, start, stop, fold_count, job_settings, directory) for i in range(fold_count)]
+    context = multiprocessing.get_context("spawn")
+    with worker_environment(threads), \
+            context.Pool(processes, initializer=limit_threads, initargs=(threads,)) as pool:
+        results = sorted(pool.map(fold_worker, jobs, chunksize=1), key=lambda result: result[0])
+
+    confusions = [result[1] for result in results]
+    accuracies = [result[2] for result in results]
+    # one test partition per fold, in the [fold][test][score] layout score_display reads
+    total_avg = gue.score_display([[[None, acc]] for acc in accuracies])
+
+    if directory is not None:
+        with open(os.path.join(directory, "stat.json"), "w") as file:
+            file.write(json.dumps({"accuracy": accuracies, "average": float(total_avg)}, indent=4, sort_keys=True))
+    return confusions, accuracies, total_avg
+
+
+if __name__ == "__main__":
+    run_folds("./data/size15rep0.data", 5, {"epochs": 1}, 0, 200000, "./result/size15rep0.folds")
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import Pool
+import taskrecon_io as tio
+from taskrecon_organizer import DirectoryOrganizer
+
+'''
+    Shared trace store for processes working on the same ./data files.
+
+    Every trace, whatever its text format, is converted once into its fixed-width .npy sidecar (taskrecon_io) and
+    handed out as a read-only np.memmap view. Workers opening the same trace map the same file, so the trace lives
+    once in the page cache instead of once per process as a list of python ints.
+    The first process to need a trace builds it under a lock file, the others wait for it and map the result.
+'''
+LOCK_SUFFIX = tio.LOCK_SUFFIX
+LOCK_POLL = 0.1
+LOCK_TIMEOUT = 600
+
+
+# pid written into the lock file, None while the holder has not written it yet or the lock is gone
+def lock_owner(lock_name):
+    try:
+        with open(lock_name, "r") as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def lock_age(lock_name):
+    try:
+        return time.time() - os.path.getmtime(lock_name)
+    except OSError:
+        return 0
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+'''
+    The lock file holds the pid of its owner. A lock is only taken over once timeout has passed and its owner is no
+    longer running (a crashed worker), a slow but live builder keeps it. On exit the lock is only removed while it is
+    still ours.
+'''
+@contextmanager
+def trace_lock(fileName, timeout=LOCK_TIMEOUT):
+    lock_name = tio.cache_name(fileName) + LOCK_SUFFIX
+    pid = os.getpid()
+    deadline = time.time() + timeout
+    while True:
+        try:
+            lock = os.open(lock_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() > deadline:
+                owner = lock_owner(lock_name)
+                if owner is None:
+                    # a lock without pid is only abandoned when its owner died before writing it
+                    stale = lock_age(lock_name) > timeout
+                else:
+                    stale = not process_alive(owner)
+                if stale:
+                    # left behind by a crashed worker
+                    print("taking over stale lock " + lock_name + " of process " + str(owner))
+                    try:
+                        os.remove(lock_name)
+                    except FileNotFoundError:
+                        pass
+                deadline = time.time() + timeout
+            time.sleep(LOCK_POLL)
+    try:
+        os.write(lock, str(pid).encode())
+        os.close(lock)
+        yield
+    finally:
+        if lock_owner(lock_name) == pid:
+            os.remove(lock_name)
+
+
+'''
+    returns a read-only memmap over the trace of fileName, building the sidecar first if it is missing or stale.
+    falls back to an in-memory array when the sidecar cannot be written.
+'''
+def open_shared(fileName):
+    view = tio.read_cache(fileName)
+    if view is not None:
+        return view
+
+    with trace_lock(fileName):
+        view = tio.read_cache(fileName)
+        if view is None:
+            trace = tio.load_trace(fileName)
+            view = tio.read_cache(fileName)
+            if view is None:
+                tio.write_cache(fileName, trace)
+                view = tio.read_cache(fileName)
+            if view is None:
+                view = tio.compact_array(trace)
+    return view
+
+
+'''
+    Per-trace manifest, stored next to the data as size15rep0.data.manifest.json and rebuilt when the source size or
+    mtime change:
+        length       number of ticks
+        labels       distinct task ids, label_card = len(labels) (what detect_label_card counts)
+        label_range  max(labels) + 1, the width of anything indexed by task id (one-hot columns, per-task features).
+                     larger than label_card when a task id never shows up in the trace
+        histogram    np.bincount of the trace (None when it holds negative values)
+        runs         number of runs, i.e. context switches + 1
+        sha256       hash of the source file
+'''
+def manifest_name(fileName):
+    return fileName + tio.MANIFEST_SUFFIX
+
+
+def file_hash(fileName):
+    digest = hashlib.sha256()
+    with open(fileName, "rb") as data_file:
+        for block in iter(lambda: data_file.read(tio.READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(fileName):
+    trace = np.asarray(open_shared(fileName))
+    labels = np.unique(trace)
+    histogram = None
+    if len(trace) > 0 and labels[0] >= 0:
+        histogram = np.bincount(trace).tolist()
+    runs = 0
+    if len(trace) > 0:
+        runs = int(np.count_nonzero(np.diff(trace))) + 1
+
+    return {
+        "source": tio.source_key(fileName),
+        "length": len(trace),
+        "labels": labels.tolist(),
+        "label_card": len(labels),
+        "label_range": int(labels[-1]) + 1 if len(labels) > 0 else 0,
+        "histogram": histogram,
+        "runs": runs,
+        "sha256": file_hash(fileName),
+    }
+
+
+def read_manifest(fileName):
+    name = manifest_name(fileName)
+    if not os.path.isfile(name):
+        return None
+    try:
+        with open(name, "r") as file:
+            manifest = json.load(file)
+    except ValueError:
+        return None
+    # manifests written before a field was added are rebuilt
+    if manifest.get("source") != tio.source_key(fileName) or "label_range" not in manifest:
+        return None
+    return manifest
+
+
+def trace_manifest(fileName):
+    manifest = read_manifest(fileName)
+    if manifest is not None:
+        return manifest
+
+    manifest = build_manifest(fileName)
+    name = manifest_name(fileName)
+    try:
+        with open(name + ".tmp" + str(os.getpid()), "w") as file:
+            file.write(json.dumps(manifest, indent=4, sort_keys=True))
+        os.replace(name + ".tmp" + str(os.getpid()), name)
+    except OSError:
+        print("could not write manifest for " + fileName)
+    return manifest
+
+
+# pool workers only build the sidecars, the views are opened by whoever needs them
+def build_worker(fileName):
+    open_shared(fileName)
+    trace_manifest(fileName)
+    return fileName
+
+
+class TraceStore:
+
+    def __init__(self, directory="./data", pattern="*.data"):
+        self.directory = directory
+        self.pattern = pattern
+        self.file_names = {}
+        self._views = {}
+
+        for fileName in tio.data_files(directory, pattern):
+            self.file_names[DirectoryOrganizer.parse_name(os.path.basename(fileName))] = fileName
+
+    # the store is passed to pool workers by paths only, each process maps the files itself
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_views"] = {}
+        return state
+
+    def keys(self):
+        return sorted(self.file_names.keys())
+
+    def path(self, key):
+        return self.file_names[key]
+
+    # converts every trace that has no valid sidecar or manifest yet, in a process pool
+    def build(self, processes=None):
+        fileNames = [self.file_names[key] for key in self.keys()]
+        if len(fileNames) > 1 and processes != 1:
+            with Pool(processes) as workers:
+                workers.map(build_worker, fileNames)
+        else:
+            for fileName in fileNames:
+                build_worker(fileName)
+        return self
+
+    def open(self, key):
+        if key not in self._views:
+            self._views[key] = open_shared(self.file_names[key])
+        return self._views[key]
+
+    def manifest(self, key):
+        return trace_manifest(self.file_names[key])
+
+    def get(self, key, start=0, stop=None):
+        return self.open(key)[start:stop]
+
+    def __getitem__(self, key):
+        return self.open(key)
+
+    def __contains__(self, key):
+        return key in self.file_names
+
+    def __len__(self):
+        return len(self.file_names)
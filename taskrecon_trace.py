@@ -0,0 +1,136 @@
+import numpy as np
+
+'''
+    Run-length encoded trace. A schedule is kept as runs of (task, duration) plus the cumulative end offset of
+    every run, so memory and most operations scale with the number of context switches instead of ticks.
+        ticks     0 0 0 4 4 15
+        tasks     [0, 4, 15]
+        durations [3, 2, 1]
+        ends      [3, 5, 6]       tick i belongs to run searchsorted(ends, i, side='right')
+    The per-tick array is only built when it is asked for (to_array / np.asarray) and is kept afterwards.
+'''
+class Trace:
+
+    def __init__(self, tasks, durations):
+        tasks = np.asarray(tasks)
+        durations = np.asarray(durations, dtype=np.int64)
+        if tasks.ndim != 1 or tasks.shape != durations.shape:
+            raise ValueError("expected tasks and durations to be 1d with the same length")
+        if np.any(durations < 0):
+            raise ValueError("durations must not be negative")
+
+        keep = durations > 0
+        tasks = tasks[keep]
+        durations = durations[keep]
+
+        # neighbouring runs of the same task are merged into one
+        if len(tasks) > 1:
+            starts = np.flatnonzero(np.concatenate(([True], tasks[1:] != tasks[:-1])))
+            durations = np.add.reduceat(durations, starts)
+            tasks = tasks[starts]
+
+        self.tasks = tasks
+        self.durations = durations
+        self.ends = np.cumsum(durations)
+        self._ticks = None
+
+    @staticmethod
+    def from_ticks(ticks):
+        ticks = np.asarray(ticks)
+        if len(ticks) == 0:
+            return Trace(ticks, np.zeros(0, dtype=np.int64))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ticks)) + 1))
+        durations = np.diff(np.append(starts, len(ticks)))
+        return Trace(ticks[starts], durations)
+
+    @property
+    def starts(self):
+        return self.ends - self.durations
+
+    def __len__(self):
+        if len(self.ends) == 0:
+            return 0
+        return int(self.ends[-1])
+
+    def __repr__(self):
+        return "Trace(runs=" + str(self.run_count()) + ", ticks=" + str(len(self)) + ")"
+
+    def run_count(self):
+        return len(self.tasks)
+
+    # index of the run holding tick i, O(log runs)
+    def run_index(self, i):
+        return int(np.searchsorted(self.ends, i, side='right'))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            length = len(self)
+            if key < 0:
+                key += length
+            if key < 0 or key >= length:
+                raise IndexError("trace index out of range")
+            return self.tasks[self.run_index(key)]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.to_array()[key]
+            return self.slice(start, stop)
+
+        # fancy and boolean indexing work on the expanded ticks
+        return self.to_array()[key]
+
+    # ticks [start, stop) as a new Trace, O(runs)
+    def slice(self, start, stop):
+        if stop <= start:
+            return Trace(self.tasks[:0], self.durations[:0])
+
+        first = self.run_index(start)
+        last = self.run_index(stop - 1)
+        durations = self.durations[first:last + 1].copy()
+        durations[0] -= start - (self.ends[first] - self.durations[first])
+        durations[-1] -= self.ends[last] - stop
+        return Trace(self.tasks[first:last + 1], durations)
+
+    def __iter__(self):
+        for task, duration in zip(self.tasks.tolist(), self.durations.tolist()):
+            for _ in range(duration):
+                yield task
+
+    def __array__(self, dtype=None, copy=None):
+        ticks = self.to_array()
+        if dtype is not None:
+            return ticks.astype(dtype)
+        if copy:
+            return ticks.copy()
+        return ticks
+
+    # per-tick trace. built once and returned read-only so the cached copy cannot be modified
+    def to_array(self):
+        if self._ticks is None:
+            self._ticks = np.repeat(self.tasks, self.durations)
+            self._ticks.flags.writeable = False
+        return self._ticks
+
+    def labels(self):
+        return np.unique(self.tasks)
+
+    def label_card(self):
+        return len(self.labels())
+
+    # number of ticks spent in every task id
+    def histogram(self, minlength=0):
+        if len(self.tasks) == 0:
+            return np.zeros(minlength, dtype=np.int64)
+        return np.bincount(self.tasks, weights=self.durations, minlength=minlength).astype(np.int64)
+
+    # binary trace, 1 where the task is value
+    def mask(self, value):
+        return Trace((self.tasks == value).astype(np.uint8), self.durations)
+
+
+# per-tick array of a Trace. anything else is passed through untouched
+def as_ticks(trace):
+    if isinstance(trace, Trace):
+        return trace.to_array()
+    return trace
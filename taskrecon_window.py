@@ -0,0 +1,220 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from taskrecon_trace import as_ticks
+
+'''
+    Windowing engine for the overlapped example layout.
+
+    The trace is encoded once as a small integer index array. Every window is a strided view into it
+    (sliding_window_view), so N windows of time_steps ticks cost nothing beyond the trace itself.
+    One-hot vectors are only produced when a window, a slice of windows or a batch is materialized
+    (np.asarray / chunk_examples), never for the whole dataset at once.
+'''
+
+
+# smallest signed integer type for task ids below label_card
+def index_dtype(label_card):
+    for dtype in (np.int8, np.int16, np.int32):
+        if label_card <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+# a contiguous integer array at most as wide as index_dtype (the uint8 memmap of a taskrecon_store sidecar) is kept
+# as it is, so the windows stay views of it instead of a private copy of the trace
+def encode_trace(trace, label_card):
+    ticks = as_ticks(trace)
+    if isinstance(ticks, np.ndarray) and ticks.dtype.kind in "iu" and ticks.flags.c_contiguous \
+            and ticks.dtype.itemsize <= index_dtype(label_card).itemsize and np.iinfo(ticks.dtype).max >= label_card - 1:
+        return ticks
+    return np.ascontiguousarray(ticks, dtype=index_dtype(label_card))
+
+
+def one_hot(indices, label_card, dtype=np.float64):
+    indices = np.asarray(indices)
+    output = np.zeros(indices.shape + (label_card,), dtype=dtype)
+    np.put_along_axis(output, indices[..., np.newaxis].astype(np.intp), 1, axis=-1)
+    return output
+
+
+# labels of one-hot shape one_hot_shape (predictions, or examples of the same label_card) are sparse task ids when
+# they lack its last axis or hold it with size 1. decided by shape only, a uint8 or int8 one-hot array is not sparse
+def is_sparse(labels, one_hot_shape):
+    shape = np.shape(labels)
+    return len(shape) == len(one_hot_shape) - 1 \
+        or (len(shape) == len(one_hot_shape) and shape[-1] == 1 != one_hot_shape[-1])
+
+
+'''
+    Lazily one-hot encoded view over an integer index array of shape (N, ...).
+    Behaves like the list of one-hot arrays the converters used to return: len(), view[i] gives one example,
+    view[a:b] gives another lazy view and np.asarray(view, dtype) materializes straight into dtype.
+    Views handed out by a WindowDataset remember it: window k of the view starts at tick first_tick + k of the
+    dataset's buffer, which lets chunk_examples build X and Y from one shared buffer (see WindowDataset.chunk).
+'''
+class OneHotView:
+
+    def __init__(self, indices, label_card, dataset=None, first_tick=0, dtype=np.float64):
+        self.indices = indices
+        self.label_card = label_card
+        self.dataset = dataset
+        self.first_tick = first_tick
+        self.dtype = dtype
+
+    @property
+    def shape(self):
+        return self.indices.shape + (self.label_card,)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return one_hot(self.indices[key], self.label_card, self.dtype)
+        if isinstance(key, slice) and self.dataset is not None:
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return OneHotView(self.indices[key], self.label_card, self.dataset, self.first_tick + start, self.dtype)
+        return OneHotView(self.indices[key], self.label_card, dtype=self.dtype)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            dtype = self.dtype
+        return one_hot(self.indices, self.label_card, dtype)
+
+
+# (count, time_steps) strided views of ticks; window i starts at tick start + i
+def window_view(ticks, time_steps, start=0, count=None):
+    windows = sliding_window_view(ticks, time_steps)
+    if count is None:
+        count = len(windows) - start
+    return windows[start:start + count]
+
+
+'''
+    Flattened multi-step targets: row i holds the one-hot ticks start + i ... start + i + pred_len - 1 back to back,
+    shape (count, pred_len * label_card). Every row is a window of the same strided view and all of them are set by
+    one scatter, so the cost is the output itself whatever pred_len is.
+'''
+def sequence_targets(ticks, label_card, start, pred_len, count, dtype=np.float64):
+    targets = np.zeros((count, pred_len, label_card), dtype=dtype)
+    if count > 0:
+        windows = window_view(np.asarray(ticks), pred_len, start, count)
+        np.put_along_axis(targets, windows[..., np.newaxis].astype(np.intp), 1, axis=-1)
+    return targets.reshape(count, pred_len * label_card)
+
+
+'''
+    Overlapped example/label windows over one encoded trace buffer.
+    With shift = offset + overlap_gap, label window i is example window i + shift: X and Y are two offset views
+    into the same ticks, so neither is ever stored on its own. chunk() keeps that sharing when the windows are
+    one-hot encoded: it encodes the ticks a chunk covers once and returns X and Y as two views into that buffer,
+    instead of two separately materialized (n, time_steps, label_card) arrays.
+'''
+class WindowDataset:
+
+    def __init__(self, trace, time_steps=100, offset=0, overlap_gap=1, label_card=None, dtype=np.float64):
+        ticks = as_ticks(trace)
+        if label_card is None:
+            label_card = len(np.unique(ticks))
+        self.ticks = encode_trace(ticks, label_card)
+        self.label_card = label_card
+        self.time_steps = time_steps
+        self.shift = offset + overlap_gap
+        self.count = max(len(self.ticks) - time_steps - self.shift, 0)
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.count
+
+    def windows(self, first_tick):
+        if self.count == 0:
+            return np.zeros((0, self.time_steps), dtype=self.ticks.dtype)
+        return window_view(self.ticks, self.time_steps, first_tick, self.count)
+
+    def example_indices(self):
+        return self.windows(0)
+
+    def label_indices(self):
+        return self.windows(self.shift)
+
+    @property
+    def X(self):
+        return OneHotView(self.example_indices(), self.label_card, self, 0, self.dtype)
+
+    @property
+    def Y(self):
+        return OneHotView(self.label_indices(), self.label_card, self, self.shift, self.dtype)
+
+    # examples [start, start + size) and their labels as two views into one one-hot buffer
+    def chunk(self, start, size, dtype=np.float32):
+        size = max(min(size, self.count - start), 0)
+        if size == 0:
+            empty = np.zeros((0, self.time_steps, self.label_card), dtype=dtype)
+            return empty, empty
+        encoded = one_hot(self.ticks[start:start + size + self.shift + self.time_steps - 1], self.label_card, dtype)
+        windows = sliding_window_view(encoded, (self.time_steps, self.label_card))[:, 0]
+        return windows[:size], windows[self.shift:self.shift + size]
+
+
+'''
+    Stream layout for stateful training: every tick is used once instead of once per overlapping window.
+    The trace is cut into batch_size contiguous streams of equal length and every stream into consecutive
+    non-overlapping windows of time_steps ticks. Batch k stacks window k of every stream, so row r of batch k
+    continues row r of batch k - 1 and a stateful LSTM carries its state along the stream (reset between epochs).
+        ticks      0 1 2 3 4 5 6 7 8 9 10 11      batch_size=2, time_steps=3
+        streams    [0 1 2 3 4 5] [6 7 8 9 10 11]
+        batch 0    [0 1 2] [6 7 8]       batch 1    [3 4 5] [9 10 11]
+    Labels are the same layout over the ticks shifted by offset + 1. Batches are (batch_size, time_steps) views.
+'''
+class StreamDataset:
+
+    def __init__(self, trace, batch_size, time_steps=100, offset=0, label_card=None):
+        ticks = as_ticks(trace)
+        if label_card is None:
+            label_card = len(np.unique(ticks))
+        self.ticks = encode_trace(ticks, label_card)
+        self.label_card = label_card
+        self.batch_size = batch_size
+        self.time_steps = time_steps
+        self.shift = offset + 1
+
+        stream_len = max(len(self.ticks) - self.shift, 0) // batch_size
+        self.batch_count = stream_len // time_steps
+        self.stream_len = self.batch_count * time_steps
+        self.example_streams = self.streams(0, stream_len)
+        self.label_streams = self.streams(self.shift, stream_len)
+
+    # (batch_size, stream_len) view, stream r starts at tick first_tick + r * stream_len
+    def streams(self, first_tick, stream_len):
+        ticks = self.ticks[first_tick:first_tick + self.batch_size * stream_len]
+        return ticks.reshape(self.batch_size, stream_len)[:, :self.stream_len]
+
+    def __len__(self):
+        return self.batch_count
+
+    def tick_count(self):
+        return self.batch_size * self.stream_len
+
+    # integer example and label windows of batch k
+    def batch(self, k):
+        if k < 0 or k >= self.batch_count:
+            raise IndexError("batch index out of range")
+        columns = slice(k * self.time_steps, (k + 1) * self.time_steps)
+        return self.example_streams[:, columns], self.label_streams[:, columns]
+
+    # labels of every batch in batch order, shape (batch_count * batch_size, time_steps)
+    def label_indices(self):
+        batches = self.label_streams.reshape(self.batch_size, self.batch_count, self.time_steps)
+        return batches.transpose(1, 0, 2).reshape(-1, self.time_steps)
+
+
+# true when examples and labels are the X and Y views of the same WindowDataset
+def shares_buffer(examples, labels):
+    return isinstance(examples, OneHotView) and isinstance(labels, OneHotView) \
+        and examples.dataset is not None and examples.dataset is labels.dataset \
+        and labels.first_tick - examples.first_tick == examples.dataset.shift
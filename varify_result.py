@@ -47,10 +47,8 @@ if __name__ == "__main__":
                                                                    batch_size=b_size)
                             i = 1
                             for fold in folds:
-                                x_train = fold[0][0]
-                                y_train = fold[0][1]
-                                x_test = fold[1][0]
-                                y_test = fold[1][1]
+                                x_train, y_train = fold[0]
+                                x_test, y_test = fold[1]
 
                                 file_name = "lstm_lstm_fold"+str(i)
 